@@ -1,66 +1,21 @@
 #!/usr/bin/env python3
 
-import sys, string
+import sys
 from collections import defaultdict
 
-from nlp_util import coreference, init, coreference_reading, coreference_rendering, head_finder, nlp_eval
+from nlp_util import coreference, init, coreference_reading, coreference_rendering, head_finder
 
-def get_cluster_info(cluster, gold_doc):
-    text = gold_doc['text']
-    gold_ner = gold_doc['ner']
+def get_cluster_info(summary):
+    return summary.labels('ner'), summary.labels('number'), summary.labels('person'), summary.labels('gender')
 
-    ner, number, person, gender = set(), set(), set(), set()
-    for mention in cluster:
-        mtext = coreference_rendering.mention_text(text, mention).lower()
-        tgender, tnumber, tperson = coreference.pronoun_properties_text(mtext)
-        if tgender != 'unknown':
-            gender.add(tgender)
-        if tnumber != 'unknown':
-            number.add(tnumber)
-        if tperson != 'unknown':
-            person.add(tperson)
-        if mention in gold_ner:
-            ner.add(gold_ner[mention])
-    return ner, number, person, gender
-
-def match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clusters, text, parses, heads):
+def match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clusters, features):
+    text = features.text
+    parses = features.parses
     changed = set()
     # Apply changes for cases where the difference is only leading or trailing punctuation
-    mapping = {}
-    used_gold = set()
     unique_to_gold = gold_mention_set.difference(auto_mention_set)
     unique_to_auto =  auto_mention_set.difference(gold_mention_set)
-    for amention in unique_to_auto:
-        sentence, astart, aend = amention
-        while (astart < aend - 1 and
-               (text[sentence][astart] == "the" or
-               (len(text[sentence][astart]) == 1 and
-               text[sentence][astart][0] not in string.ascii_letters))):
-            astart += 1
-        while (astart < aend - 1 and
-               (text[sentence][aend - 1] == "'s" or
-               (len(text[sentence][aend - 1]) == 1 and
-               text[sentence][aend - 1][0] not in string.ascii_letters))):
-            aend -= 1
-        for gmention in unique_to_gold:
-            if gmention in used_gold:
-                continue
-            gsentence, gstart, gend = gmention
-            if sentence != gsentence:
-                continue
-            while (gstart < gend - 1 and
-                   (text[sentence][gstart] == "the" or
-                   (len(text[sentence][gstart]) == 1 and
-                   text[sentence][gstart][0] not in string.ascii_letters))):
-                gstart += 1
-            while (gstart < gend - 1 and
-                   (text[sentence][gend - 1] == "'s" or
-                   (len(text[sentence][gend - 1]) == 1 and
-                   text[sentence][gend - 1][0] not in string.ascii_letters))):
-                gend -= 1
-            if astart == gstart and aend == gend:
-                mapping[amention] = gmention
-                used_gold.add(gmention)
+    mapping = coreference.match_trimmed_spans(unique_to_auto, unique_to_gold, text)
     # Apply mapping to create new auto_mention_set
     for mention in mapping:
         auto_mention_set.remove(mention)
@@ -75,7 +30,7 @@ def match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clu
     head_dict = defaultdict(lambda: {'auto': [], 'gold': []})
     for mention in auto_mention_set.difference(gold_mention_set):
         sentence, start, end = mention
-        head = coreference.mention_head(mention, text, parses, heads, default_last=True)
+        head = features.head(mention)
         # This will default to last word if the mention is not a constituent, is
         # there an alternative?
         if head is not None:
@@ -83,7 +38,7 @@ def match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clu
             head_dict[head]['auto'].append(mention)
     for mention in gold_mention_set.difference(auto_mention_set):
         sentence, start, end = mention
-        head = coreference.mention_head(mention, text, parses, heads, default_last=True)
+        head = features.head(mention)
         if head is not None:
             head = (mention[0], head[0])
             head_dict[head]['gold'].append(mention)
@@ -146,9 +101,11 @@ def match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clu
         nchanges.append(tuple(properties))
     return nchanges
 
-def split_merge_properties(part, cluster, auto, gold, text, parses, heads, gold_mentions, gold_clusters, auto_mentions, gold_doc):
+def split_merge_properties(part, cluster, auto_of, features, gold_mentions, gold_clusters, auto_mentions):
     ans = []
     rest = cluster.difference(part)
+    part_summary = features.cluster(part)
+    rest_summary = features.rest(cluster, part)
 
     # Size of part
     ans.append(len(part)) # 0
@@ -160,7 +117,7 @@ def split_merge_properties(part, cluster, auto, gold, text, parses, heads, gold_
     mtext = None
     if len(part) == 1:
         mention = next(iter(part))
-        mtext = '_'.join(coreference_rendering.mention_text(text, mention).lower().split())
+        mtext = '_'.join(features.text_lower(mention).split())
     ans.append(mtext) # 2
 
     # Does this part have any cataphoric pronouns
@@ -169,32 +126,23 @@ def split_merge_properties(part, cluster, auto, gold, text, parses, heads, gold_
     for mention in cluster:
         if mention in auto_mentions:
             acluster.add(mention)
-    non_pronoun = min_non_pronoun(acluster, text, parses, heads)
+    non_pronoun = min_non_pronoun(acluster, features)
     if non_pronoun is not None and non_pronoun not in part:
         for mention in part:
             if mention in auto_mentions and mention < non_pronoun:
-                mtype = coreference.mention_type(mention, text, parses, heads)
-                if mtype == 'pronoun':
+                if features.type(mention) == 'pronoun':
                     count += 1
     ans.append("%d_cataphoric" % count)
 
     # Number of pronouns, nominals, names present in it
-    type_counts = {'pronoun': 0, 'name': 0, 'nominal': 0}
-    for mention in part:
-        mtype = coreference.mention_type(mention, text, parses, heads)
-        type_counts[mtype] += 1
-    ans.append(type_counts['name']) # 3
-    ans.append(type_counts['nominal']) # 4
-    ans.append(type_counts['pronoun']) # 5
+    ans.append(part_summary.count('types', 'name')) # 3
+    ans.append(part_summary.count('types', 'nominal')) # 4
+    ans.append(part_summary.count('types', 'pronoun')) # 5
 
     # Number of pronouns, nominals, names, in rest
-    type_counts = {'pronoun': 0, 'name': 0, 'nominal': 0}
-    for mention in rest:
-        mtype = coreference.mention_type(mention, text, parses, heads)
-        type_counts[mtype] += 1
-    ans.append(type_counts['name']) # 6
-    ans.append(type_counts['nominal']) # 7
-    ans.append(type_counts['pronoun']) # 8
+    ans.append(rest_summary.count('types', 'name')) # 6
+    ans.append(rest_summary.count('types', 'nominal')) # 7
+    ans.append(rest_summary.count('types', 'pronoun')) # 8
 
     # Whether this is extra
     all_extra = True
@@ -212,40 +160,14 @@ def split_merge_properties(part, cluster, auto, gold, text, parses, heads, gold_
 
     # Whether there is an exact string match between a mention in the part and cluster (excluding pronouns)
     match_present = 'no_string_match'
-    for smention in part:
-        mtype = coreference.mention_type(smention, text, parses, heads)
-        if mtype == 'pronoun':
-            continue
-        for rmention in rest:
-            mtype = coreference.mention_type(rmention, text, parses, heads)
-            if mtype == 'pronoun':
-                continue
-            stext = coreference_rendering.mention_text(text, smention).lower()
-            rtext = coreference_rendering.mention_text(text, rmention).lower()
-            if stext == rtext:
-                match_present = 'string_match'
-                break
-        if 'no' not in match_present:
-            break
+    if rest_summary.shares('non_pronoun_texts', part_summary):
+        match_present = 'string_match'
     ans.append(match_present) # 11
 
     # Whether there is a head match between a mention in the part and cluster (excluding pronouns)
     match_present = 'no_head_match'
-    for smention in part:
-        mtype = coreference.mention_type(smention, text, parses, heads)
-        if mtype == 'pronoun':
-            continue
-        for rmention in rest:
-            mtype = coreference.mention_type(rmention, text, parses, heads)
-            if mtype == 'pronoun':
-                continue
-            shead = coreference.mention_head(smention, text, parses, heads)[1].lower()
-            rhead = coreference.mention_head(rmention, text, parses, heads)[1].lower()
-            if shead == rhead:
-                match_present = 'head_match'
-                break
-        if 'no' not in match_present:
-            break
+    if rest_summary.shares('non_pronoun_heads', part_summary):
+        match_present = 'head_match'
     ans.append(match_present) # 12
 
     # What has happened, or will happen
@@ -253,24 +175,24 @@ def split_merge_properties(part, cluster, auto, gold, text, parses, heads, gold_
     action = 'nothing'
     if example not in gold_mentions:
         action = 'delete'
-    elif part != set(gold_clusters[gold_mentions[example]]):
-        action = 'merge'
+    else:
+        gcluster = gold_clusters[gold_mentions[example]]
+        if len(part) != len(gcluster) or part != set(gcluster):
+            action = 'merge'
     ans.append(action) # 13
 
     action = 'nothing'
     if example not in auto_mentions:
         action = 'introduce'
     else:
-        for acluster in auto:
-            if example in acluster:
-                if acluster != part:
-                    action = 'split'
-                break
+        acluster = auto_of.get(example)
+        if acluster is not None and acluster != part:
+            action = 'split'
     ans.append(action) # 14
 
     # NER, number, person, gender
-    cproperties = get_cluster_info(rest, gold_doc)
-    pproperties = get_cluster_info(part, gold_doc)
+    cproperties = get_cluster_info(rest_summary)
+    pproperties = get_cluster_info(part_summary)
     for prop in range(4):
         ans.append(cproperties[prop] == pproperties[prop])
         cprop = list(cproperties[prop])
@@ -282,35 +204,29 @@ def split_merge_properties(part, cluster, auto, gold, text, parses, heads, gold_
 
     return ans
 
-def mention_error_properties(mention, cluster, text, parses, heads, gold_doc):
+def mention_error_properties(mention, cluster, features):
     ans = []
     rest = cluster.difference({mention})
+    mention_summary = features.cluster({mention})
+    rest_summary = features.rest(cluster, {mention})
 
     # Type of mention
-    mtype = coreference.mention_type(mention, text, parses, heads)
-    ans.append(mtype)
+    ans.append(features.type(mention))
 
     # Text of mention
-    mtext = coreference_rendering.mention_text(text, mention).lower()
+    mtext = features.text_lower(mention)
     ans.append('_'.join(mtext.split()))
 
     # Does it have a string match with something in the cluster?
     matches = 'no_text_match'
-    for omention in rest:
-        otext = coreference_rendering.mention_text(text, omention).lower()
-        if otext == mtext:
-            matches = 'text_match'
-            break
+    if rest_summary.has('texts', mtext):
+        matches = 'text_match'
     ans.append(matches)
 
     # Does it have a head match with something in the cluster?
     matches = 'no_head_match'
-    mhead = coreference.mention_head(mention, text, parses, heads)[1].lower()
-    for omention in rest:
-        ohead = coreference.mention_head(omention, text, parses, heads)[1].lower()
-        if mhead == ohead:
-            matches = 'head_match'
-            break
+    if rest_summary.has('heads', features.head_word(mention)):
+        matches = 'head_match'
     ans.append(matches)
 
     # Is it nested within another mention in the cluster
@@ -338,12 +254,12 @@ def mention_error_properties(mention, cluster, text, parses, heads, gold_doc):
     ans.append(mention == max(cluster))
 
     # Is it a case of cataphora?
-    non_pronoun = min_non_pronoun(cluster, text, parses, heads)
+    non_pronoun = min_non_pronoun(cluster, features)
     ans.append(non_pronoun is not None and mention < non_pronoun)
 
     # Do NER, number, person, or gender of mention and cluster match?
-    cluster_properties = get_cluster_info(rest, gold_doc)
-    mention_properties = get_cluster_info({mention}, gold_doc)
+    cluster_properties = get_cluster_info(rest_summary)
+    mention_properties = get_cluster_info(mention_summary)
     words = ['ner', 'number', 'person', 'gender']
     for i in range(4):
         if len(mention_properties[i]) == 0 or len(cluster_properties[i]) == 0:
@@ -355,120 +271,162 @@ def mention_error_properties(mention, cluster, text, parses, heads, gold_doc):
 
     return ans
 
-def cluster_error_properties(cluster, text, parses, heads, gold_doc):
+def cluster_error_properties(cluster, features):
     ans = []
+    summary = features.cluster(cluster)
 
     # How big is the cluster
     ans.append(len(cluster))
 
     # Counts of each type in the cluster
-    counts = [0, 0, 0]
-    for mention in cluster:
-        mtype = coreference.mention_type(mention, text, parses, heads)
-        if mtype == 'name':
-            counts[0] += 1
-        elif mtype == 'nominal':
-            counts[1] += 1
-        elif mtype == 'pronoun':
-            counts[2] += 1
+    counts = [summary.count('types', 'name'), summary.count('types', 'nominal'), summary.count('types', 'pronoun')]
     ans += counts
 
     # If it is one pronoun and something else, more info on the pronoun
     if counts[0] + counts[1] == 1 and counts[2] == 1:
         pronoun = None
         for mention in cluster:
-            mtype = coreference.mention_type(mention, text, parses, heads)
-            if mtype == 'pronoun':
+            if features.type(mention) == 'pronoun':
                 pronoun = mention
-        mtext = coreference_rendering.mention_text(text, pronoun).lower()
-        ans.append(mtext)
+        ans.append(features.text_lower(pronoun))
     else:
         ans.append(None)
 
     # Number of cataphoric pronouns
     cataphora = 0
-    non_pronoun = min_non_pronoun(cluster, text, parses, heads, True)
+    non_pronoun = min_non_pronoun(cluster, features, True)
     if non_pronoun is not None:
         for mention in cluster:
             if mention < non_pronoun:
-                mtype = coreference.mention_type(mention, text, parses, heads)
-                if mtype == 'pronoun':
+                if features.type(mention) == 'pronoun':
                     cataphora += 1
     ans.append(cataphora)
 
     # NER types
-    ner = set()
-    for mention in cluster:
-        if mention in gold_doc['ner']:
-            ner.add(gold_doc['ner'][mention])
-    ner = list(ner)
+    ner = list(summary.labels('ner'))
     ner.sort()
     ans.append(ner)
 
     # Are all the mentions the same?
-    mtext = set()
-    for mention in cluster:
-        mtext.add(coreference_rendering.mention_text(text, mention).lower())
-    ans.append(len(mtext) == 1)
+    ans.append(len(summary.labels('texts')) == 1)
 
     # Are all the heads the same?
-    mhead = set()
-    for mention in cluster:
-        mhead.add(coreference.mention_head(mention, text, parses, heads)[1].lower())
-    ans.append(len(mhead) == 1)
+    ans.append(len(summary.labels('heads')) == 1)
 
     return ans
 
-def repair(auto, gold, auto_mentions, gold_mention_set, text, parses, heads, gold_clusters, gold_mentions, gold_doc):
-    changes = defaultdict(lambda: [])
+class ChangeList:
+    '''The changes of one type, in the order they were added.  Each change
+    is a tuple starting with a set of mentions, and changes are indexed by
+    those mentions, so they can be found and removed without a scan.'''
+    def __init__(self):
+        self.changes = {}
+        self.by_mention = defaultdict(dict)
+
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(list(self.changes.values()))
+
+    def __repr__(self):
+        return repr(list(self.changes.values()))
+
+    def append(self, change):
+        key = id(change)
+        self.changes[key] = change
+        for mention in change[0]:
+            self.by_mention[mention][key] = change
+
+    def remove(self, change):
+        key = id(change)
+        if key not in self.changes:
+            raise ValueError("ChangeList.remove(x): x not in list")
+        self.changes.pop(key)
+        for mention in change[0]:
+            changes = self.by_mention[mention]
+            changes.pop(key)
+            if len(changes) == 0:
+                self.by_mention.pop(mention)
+
+    def first_containing(self, mention, singleton=False):
+        '''The earliest change whose mentions include this one (and no others
+        if singleton is True), or None.'''
+        for change in self.by_mention.get(mention, {}).values():
+            if not singleton or len(change[0]) == 1:
+                return change
+        return None
+
+    def first_matching(self, mentions):
+        '''The earliest change whose set of mentions is equal to this one, or
+        None.'''
+        for change in self.by_mention.get(next(iter(mentions)), {}).values():
+            if change[0] == mentions:
+                return change
+        return None
+
+class ChangeSet(dict):
+    '''The changes for a confusion group, as a ChangeList for each type of
+    change, created the first time the type is used.'''
+    def __missing__(self, name):
+        self[name] = ChangeList()
+        return self[name]
+
+def repair(auto, gold, auto_mentions, gold_mention_set, features, gold_clusters, gold_mentions):
+    changes = ChangeSet()
+
+    # Note which cluster of the group each mention is in
+    gold_index = {}
+    for position, gcluster in enumerate(gold):
+        for mention in gcluster:
+            gold_index[mention] = position
+    auto_of = {}
+    for acluster in auto:
+        for mention in acluster:
+            auto_of[mention] = acluster
 
-    # Split auto into pieces that each contain only one cluster
-    nauto = []
+    # Split auto into pieces that each contain only one cluster, noting the
+    # gold cluster each piece is part of
+    pieces = [[] for gcluster in gold]
     for acluster in auto:
+        overlaps = set()
+        for mention in acluster:
+            position = gold_index.get(mention)
+            if position is not None:
+                overlaps.add(position)
         used = set()
-        for gcluster in gold:
-            intersection = acluster.intersection(gcluster)
-            if len(intersection) > 0:
-                nauto.append(intersection)
-                used.update(intersection)
-                if len(intersection) != len(acluster):
-                    properties = ['split'] + split_merge_properties(intersection, acluster, auto, gold, text, parses, heads, gold_mentions, gold_clusters, auto_mentions, gold_doc)
-                    changes["split"].append((intersection.copy(), acluster.copy(), '', properties))
+        for position in sorted(overlaps):
+            intersection = acluster.intersection(gold[position])
+            pieces[position].append(intersection)
+            used.update(intersection)
+            if len(intersection) != len(acluster):
+                properties = ['split'] + split_merge_properties(intersection, acluster, auto_of, features, gold_mentions, gold_clusters, auto_mentions)
+                changes["split"].append((intersection.copy(), acluster.copy(), '', properties))
         for mention in acluster.difference(used):
-            properties = ['split'] + split_merge_properties({mention}, acluster, auto, gold, text, parses, heads, gold_mentions, gold_clusters, auto_mentions, gold_doc)
+            properties = ['split'] + split_merge_properties({mention}, acluster, auto_of, features, gold_mentions, gold_clusters, auto_mentions)
             changes["split"].append(({mention}, acluster.copy(), 'going nowhere', properties))
             changes["remove"].append(({mention},))
 
     # Add missing mentions as singletons:
-    for cluster in gold:
+    for position, cluster in enumerate(gold):
         for mention in cluster:
             if mention not in auto_mentions:
                 changes['introduce'].append(({mention},))
-                nauto.append({mention})
+                pieces[position].append({mention})
 
     # Merge pieces together
-    for gcluster in gold:
-        for acluster in nauto:
-            if acluster != gcluster and acluster.issubset(gcluster):
-                properties = ['merge'] + split_merge_properties(acluster, gcluster, auto, gold, text, parses, heads, gold_mentions, gold_clusters, auto_mentions, gold_doc)
+    for position, gcluster in enumerate(gold):
+        for acluster in pieces[position]:
+            if acluster != gcluster:
+                properties = ['merge'] + split_merge_properties(acluster, gcluster, auto_of, features, gold_mentions, gold_clusters, auto_mentions)
                 changes["merge"].append((acluster.copy(), gcluster.copy(), properties))
 
     return changes
 
-def min_non_pronoun(cluster, text, parses, heads, check_head=False):
-    ans = None
-    for mention in cluster:
-        if coreference.mention_type(mention, text, parses, heads) == 'pronoun':
-            continue
-        if check_head:
-            head = coreference.mention_head(mention, text, parses, heads, default_last=True)
-            if coreference.mention_type((mention[0], head[0][0], head[0][1]), text, parses, heads) == 'pronoun':
-                continue
-        if ans is None or ans > mention:
-            ans = mention
-    return ans
+def min_non_pronoun(cluster, features, check_head=False):
+    return features.cluster(cluster).min_non_pronoun(check_head)
 
-def categorise(auto, gold, changes, text, parses, heads, gold_mention_set, auto_mentions, gold_doc):
+def categorise(auto, gold, changes, features, gold_mention_set, auto_mentions):
     # Not an Entity
     # A set of splits to singles that cover an entire cluster
     to_add = defaultdict(lambda: [])
@@ -476,8 +434,7 @@ def categorise(auto, gold, changes, text, parses, heads, gold_mention_set, auto_
         is_disjoint = True
         for mention in split[1]:
             if mention in gold_mention_set:
-                mtype = coreference.mention_type(mention, text, parses, heads)
-                if mtype != 'pronoun':
+                if features.type(mention) != 'pronoun':
                     is_disjoint = False
                     break
         if is_disjoint:
@@ -496,15 +453,11 @@ def categorise(auto, gold, changes, text, parses, heads, gold_mention_set, auto_
             split_cluster.update(split[0])
         if len(split_cluster) == 1:
             continue
-        properties = ['extra'] + cluster_error_properties(split_cluster, text, parses, heads, gold_doc)
+        properties = ['extra'] + cluster_error_properties(split_cluster, features)
         changes['extra entity'].append((split_cluster, cluster.copy(), properties))
         for split in splits:
             changes['split'].remove(split)
-            to_remove = None
-            for remove in changes['remove']:
-                if next(iter(split[0])) in remove[0]:
-                    to_remove = remove
-                    break
+            to_remove = changes['remove'].first_containing(next(iter(split[0])))
             if to_remove is not None:
                 changes['remove'].remove(to_remove)
 
@@ -518,24 +471,22 @@ def categorise(auto, gold, changes, text, parses, heads, gold_mention_set, auto_
             if mention not in auto_mentions:
                 missing += 1
             else:
-                if coreference.mention_type(mention, text, parses, heads) != 'pronoun':
+                if features.type(mention) != 'pronoun':
                     is_disjoint = False
                     break
         if is_disjoint and missing > 1:
-            properties = ['missing'] + cluster_error_properties(cluster, text, parses, heads, gold_doc)
+            properties = ['missing'] + cluster_error_properties(cluster, features)
             changes['missing entity'].append((cluster.copy(),properties))
             for mention in cluster:
                 if mention in auto_mentions:
                     continue
                 operations = []
-                for merge in changes['merge']:
-                    if len(merge[0]) == 1 and mention in merge[0]:
-                        operations.append(merge)
-                        break
-                for introduce in changes['introduce']:
-                    if len(introduce[0]) == 1 and mention in introduce[0]:
-                        operations.append(introduce)
-                        break
+                merge = changes['merge'].first_containing(mention, True)
+                if merge is not None:
+                    operations.append(merge)
+                introduce = changes['introduce'].first_containing(mention, True)
+                if introduce is not None:
+                    operations.append(introduce)
                 to_remove.append(tuple(operations))
     for merge, introduce in to_remove:
         changes['merge'].remove(merge)
@@ -544,34 +495,20 @@ def categorise(auto, gold, changes, text, parses, heads, gold_mention_set, auto_
     # Remove the splits and merges that involve the earliest non-pronoun mentions in the cluster
     to_remove = []
     for split in changes['split']:
-        if min_non_pronoun(split[0], text, parses, heads) == min_non_pronoun(split[1], text, parses, heads):
-            if min_non_pronoun(split[0], text, parses, heads) is None and min(split[0]) != min(split[1]):
+        if min_non_pronoun(split[0], features) == min_non_pronoun(split[1], features):
+            if min_non_pronoun(split[0], features) is None and min(split[0]) != min(split[1]):
                 continue
-            found = False
-            for remove in changes['remove']:
-                if split[0] == remove[0]:
-                    to_remove.append((split, remove))
-                    found = True
-                    break
-            if not found:
-                to_remove.append((split, None))
+            to_remove.append((split, changes['remove'].first_matching(split[0])))
     for split, remove in to_remove:
         changes['split'].remove(split)
         if remove is not None:
             changes['remove'].remove(remove)
     to_remove = []
     for merge in changes['merge']:
-        if min_non_pronoun(merge[0], text, parses, heads) == min_non_pronoun(merge[1], text, parses, heads):
-            if min_non_pronoun(merge[0], text, parses, heads) is None and min(merge[0]) != min(merge[1]):
+        if min_non_pronoun(merge[0], features) == min_non_pronoun(merge[1], features):
+            if min_non_pronoun(merge[0], features) is None and min(merge[0]) != min(merge[1]):
                 continue
-            found = False
-            for introduce in changes['introduce']:
-                if introduce[0] == merge[0]:
-                    found = True
-                    to_remove.append((merge, introduce))
-                    break
-            if not found:
-                to_remove.append((merge, None))
+            to_remove.append((merge, changes['introduce'].first_matching(merge[0])))
     for merge, introduce in to_remove:
         changes['merge'].remove(merge)
         if introduce is not None:
@@ -585,51 +522,39 @@ def categorise(auto, gold, changes, text, parses, heads, gold_mention_set, auto_
                 to_remove.append(split)
     for split in to_remove:
         changes['split'].remove(split)
-        to_remove = None
-        for remove in changes['remove']:
-            if next(iter(split[0])) in remove[0]:
-                to_remove = remove
-                break
+        to_remove = changes['remove'].first_containing(next(iter(split[0])))
         if to_remove is not None:
             changes['remove'].remove(to_remove)
-        properties = ['extra'] + mention_error_properties(next(iter(split[0])), split[1], text, parses, heads, gold_doc)
+        properties = ['extra'] + mention_error_properties(next(iter(split[0])), split[1], features)
         changes['extra mention'].append((split[0], split, properties))
 
     # Pair up introduces and merges to form incorrectly non-referential
     to_remove = []
     for merge in changes['merge']:
         if len(merge[0]) == 1:
-            elsewhere = False
-            for split in changes['split']:
-                if len(split[0]) == 1:
-                    smention = list(split[0])[0]
-                    mmention = list(merge[0])[0]
-                    if smention == mmention:
-                        elsewhere = True
-                        break
+            mention = list(merge[0])[0]
+            elsewhere = changes['split'].first_containing(mention, True) is not None
             if not elsewhere:
-                mention = list(merge[0])[0]
-                if mention != min_non_pronoun(merge[1], text, parses, heads) and mention not in auto_mentions:
-                    properties = ['missing'] + mention_error_properties(mention, merge[1], text, parses, heads, gold_doc)
+                if mention != min_non_pronoun(merge[1], features) and mention not in auto_mentions:
+                    properties = ['missing'] + mention_error_properties(mention, merge[1], features)
                     changes['missing mention'].append(({mention}, merge[1], merge, properties))
-                    for introduce in changes['introduce']:
-                        if len(introduce[0]) == 1 and mention in introduce[0]:
-                            to_remove.append((merge, introduce))
-                            break
+                    introduce = changes['introduce'].first_containing(mention, True)
+                    if introduce is not None:
+                        to_remove.append((merge, introduce))
     for merge, introduce in to_remove:
         changes['merge'].remove(merge)
         changes['introduce'].remove(introduce)
 
     return changes
 
-def print_pre_change_info(out, auto, gold, auto_mentions, gold_mention_set, text, parses, heads, gold_clusters, gold_mentions, gold_doc, auto_clusters):
+def print_pre_change_info(out, auto, gold, auto_mentions, gold_mention_set, features, gold_clusters, gold_mentions, auto_clusters):
     # Cataphora
     mentions = defaultdict(lambda: [None, None, None])
 
     for cluster in gold:
-        non_pronoun = min_non_pronoun(cluster, text, parses, heads)
+        non_pronoun = min_non_pronoun(cluster, features)
         for mention in cluster:
-            mtype = coreference.mention_type(mention, text, parses, heads)
+            mtype = features.type(mention)
             if mtype == 'pronoun':
                 if non_pronoun is not None and mention < non_pronoun:
                     mentions[mention][0] = True
@@ -637,9 +562,9 @@ def print_pre_change_info(out, auto, gold, auto_mentions, gold_mention_set, text
                     mentions[mention][0] = False
 
     for cluster in auto:
-        non_pronoun = min_non_pronoun(cluster, text, parses, heads)
+        non_pronoun = min_non_pronoun(cluster, features)
         for mention in cluster:
-            mtype = coreference.mention_type(mention, text, parses, heads)
+            mtype = features.type(mention)
             if mtype == 'pronoun':
                 if non_pronoun is not None and mention < non_pronoun:
                     mentions[mention][1] = True
@@ -653,15 +578,15 @@ def print_pre_change_info(out, auto, gold, auto_mentions, gold_mention_set, text
     for mention in in_both:
         acluster = auto_clusters[auto_mentions[mention]]
         gcluster = gold_clusters[gold_mentions[mention]]
-        anon_pronoun = min_non_pronoun(acluster, text, parses, heads)
-        gnon_pronoun = min_non_pronoun(gcluster, text, parses, heads)
+        anon_pronoun = min_non_pronoun(acluster, features)
+        gnon_pronoun = min_non_pronoun(gcluster, features)
         if anon_pronoun == gnon_pronoun:
             mentions[mention][2] = True
         else:
             mentions[mention][2] = False
 
     for mention in mentions:
-        mtext = coreference_rendering.mention_text(text, mention).lower()
+        mtext = features.text_lower(mention)
         print("Cataphoric properties", mentions[mention], mtext, file=out['out'])
 
 def process_document(doc_name, part_name, gold_doc, auto_doc, out, remove_singletons=True):
@@ -678,6 +603,8 @@ def process_document(doc_name, part_name, gold_doc, auto_doc, out, remove_single
     gold_mentions = gold_doc['mentions']
     gold_clusters = gold_doc['clusters']
 
+    features = coreference.MentionFeatures(text, gold_parses, gold_heads, gold_doc['ner'])
+
     auto_mentions = auto_doc['mentions'].copy()
     auto_clusters = auto_doc['clusters'].copy()
 
@@ -702,7 +629,7 @@ def process_document(doc_name, part_name, gold_doc, auto_doc, out, remove_single
 
     # Fix boundary match errors
     errors = []
-    span_errors = match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clusters, text, gold_parses, gold_heads)
+    span_errors = match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clusters, features)
     if len(span_errors) == 0:
         print("No", end=" ", file=out['out'])
         print("No", end=" ", file=out['short out'])
@@ -726,27 +653,34 @@ def process_document(doc_name, part_name, gold_doc, auto_doc, out, remove_single
 
     coreference_rendering.print_conll_style_part(out['error: span mismatch'], text, auto_mentions, doc_name, part_name)
 
-    auto_mentions_split = auto_mentions.copy()
-    auto_mentions_extra_mention = auto_mentions.copy()
-    auto_mentions_extra_entity = auto_mentions.copy()
-    auto_mentions_merge = auto_mentions.copy()
-    auto_mentions_missing_mention = auto_mentions.copy()
-    auto_mentions_missing_entity = auto_mentions.copy()
-    auto_mentions_extra_mention_prog = auto_mentions.copy()
-    auto_mentions_extra_entity_prog = auto_mentions.copy()
-    auto_mentions_merge_prog = auto_mentions.copy()
-    auto_mentions_missing_mention_prog = auto_mentions.copy()
-    auto_mentions_missing_entity_prog = auto_mentions.copy()
+    # Each corrected version stores only its changes to auto_mentions
+    auto_mentions_split = coreference.MentionOverlay(auto_mentions)
+    auto_mentions_extra_mention = coreference.MentionOverlay(auto_mentions)
+    auto_mentions_extra_entity = coreference.MentionOverlay(auto_mentions)
+    auto_mentions_merge = coreference.MentionOverlay(auto_mentions)
+    auto_mentions_missing_mention = coreference.MentionOverlay(auto_mentions)
+    auto_mentions_missing_entity = coreference.MentionOverlay(auto_mentions)
+    auto_mentions_extra_mention_prog = coreference.MentionOverlay(auto_mentions)
+    auto_mentions_extra_entity_prog = coreference.MentionOverlay(auto_mentions)
+    auto_mentions_merge_prog = coreference.MentionOverlay(auto_mentions)
+    auto_mentions_missing_mention_prog = coreference.MentionOverlay(auto_mentions)
+    auto_mentions_missing_entity_prog = coreference.MentionOverlay(auto_mentions)
     max_cluster = 0
     if len(auto_mentions) > 0:
         max_cluster = auto_mentions[max(auto_mentions, key=lambda mention: auto_mentions[mention])]
 
-    groups = coreference.confusion_groups(gold_mentions, auto_mentions, gold_clusters, auto_clusters)
+    groups = coreference.confusion_group_ids(gold_mentions, auto_mentions, gold_clusters, auto_clusters)
     for auto, gold in groups:
-###     print_pre_change_info(out, auto, gold, auto_mentions, gold_mention_set, text, gold_parses, gold_heads, gold_clusters, gold_mentions, gold_doc, auto_clusters)
-
-        if nlp_eval.coreference_cluster_match(gold, auto):
-            continue
+        # A group without errors is a single system cluster that exactly
+        # matches a single gold cluster, so only build sets for the rest
+        if len(auto) == 1 and len(gold) == 1:
+            acluster = auto_clusters[auto[0]]
+            gcluster = gold_clusters[gold[0]]
+            if len(acluster) == len(gcluster) and set(acluster) == set(gcluster):
+                continue
+        auto = [set(auto_clusters[cluster]) for cluster in auto]
+        gold = [set(gold_clusters[cluster]) for cluster in gold]
+###     print_pre_change_info(out, auto, gold, auto_mentions, gold_mention_set, features, gold_clusters, gold_mentions, auto_clusters)
 
         # Print clusters with errors shown
         print("", file=out['out'])
@@ -755,7 +689,7 @@ def process_document(doc_name, part_name, gold_doc, auto_doc, out, remove_single
         colours2 = coreference_rendering.print_cluster_error_group([auto, gold], out['short out'], text, gold_parses, gold_heads, gold_mentions)
 
         # Work out the errors
-        changes = repair(auto, gold, auto_mentions, gold_mention_set, text, gold_parses, gold_heads, gold_clusters, gold_mentions, gold_doc)
+        changes = repair(auto, gold, auto_mentions, gold_mention_set, features, gold_clusters, gold_mentions)
         print("\nRaw changes:", file=out['out'])
         for name in changes:
             print(name, len(changes[name]), file=out['out'])
@@ -763,7 +697,7 @@ def process_document(doc_name, part_name, gold_doc, auto_doc, out, remove_single
                 errors.append(('raw ' + name, change))
 
         # Categorise
-        changes = categorise(auto, gold, changes, text, gold_parses, gold_heads, gold_mention_set, auto_mentions, gold_doc)
+        changes = categorise(auto, gold, changes, features, gold_mention_set, auto_mentions)
 
         # Apply updates to corrected sets
         if 'split' in changes:
@@ -809,7 +743,7 @@ def process_document(doc_name, part_name, gold_doc, auto_doc, out, remove_single
         if 'merge' in changes:
             for change in changes['merge']:
                 for cauto_mentions in [auto_mentions_merge, auto_mentions_merge_prog, auto_mentions_missing_mention_prog, auto_mentions_missing_entity_prog]:
-                    non_pronoun = min_non_pronoun(change[1], text, gold_parses, gold_heads)
+                    non_pronoun = min_non_pronoun(change[1], features)
                     if non_pronoun is None:
                         non_pronoun = min(change[1])
                     if non_pronoun not in cauto_mentions:
@@ -823,9 +757,7 @@ def process_document(doc_name, part_name, gold_doc, auto_doc, out, remove_single
                         elif cauto_mentions[mention] not in done:
                             pcluster_id = cauto_mentions[mention]
                             done.add(pcluster_id)
-                            for smention in cauto_mentions:
-                                if cauto_mentions[smention] == pcluster_id:
-                                    cauto_mentions[smention] = ncluster_id
+                            cauto_mentions.relabel(pcluster_id, ncluster_id)
 
         if 'missing mention' in changes:
             for change in changes['missing mention']:
@@ -909,10 +841,13 @@ def process_document(doc_name, part_name, gold_doc, auto_doc, out, remove_single
 
 if __name__ == '__main__':
     # Process params
-    init.argcheck(sys.argv, 4, 5, "Print coreference resolution errors", "<output_prefix> <gold_dir> <test_file> [remove singletons? T | F (default is True)]")
+    init.argcheck(sys.argv, 4, 6, "Print coreference resolution errors", "<output_prefix> <gold_dir> <test_file> [remove singletons? T | F (default is True)] [gold cache dir]")
     remove_singletons = True
-    if len(sys.argv) == 5 and sys.argv[-1] == 'F':
+    if len(sys.argv) >= 5 and sys.argv[4] == 'F':
         remove_singletons = False
+    cache_dir = None
+    if len(sys.argv) == 6:
+        cache_dir = sys.argv[5]
     out = {
         'out': open(sys.argv[1] + '.classified.detailed', 'w'),
         'properties': open(sys.argv[1] + '.classified.properties', 'w'),
@@ -1015,27 +950,21 @@ if __name__ == '__main__':
 '''
     print(start_explanation, file=out['properties'])
 
-    # Read input
-    auto = coreference_reading.read_conll_coref_system_output(sys.argv[3])
-    gold = coreference_reading.read_conll_matching_files(auto, sys.argv[2])
-
-    # Define an order
-    order = []
-    for doc in auto:
-        for part in auto[doc]:
-            order.append((doc, part))
-    order.sort()
+    # Read input one document at a time, in sorted order
+    gold_index = coreference_reading.read_conll_index(sys.argv[2])
+    parts = coreference_reading.generate_conll_system_and_gold_docs(sys.argv[3], sys.argv[2], gold_index, cache_dir)
 
     # Work out the errors
-    counts = defaultdict(lambda: [])
-    for doc, part in order:
-        if doc not in gold or part not in gold[doc]:
+    counts = defaultdict(int)
+    for doc, part, auto_doc, gold_doc in parts:
+        if gold_doc is None:
             print(doc, part, "not in gold", file=sys.stderr)
-        if 'text' not in auto[doc][part]:
-            auto[doc][part]['text'] = gold[doc][part]['text']
-        errors = process_document(doc, part, gold[doc][part], auto[doc][part], out, remove_singletons)
+            continue
+        if 'text' not in auto_doc:
+            auto_doc['text'] = gold_doc['text']
+        errors = process_document(doc, part, gold_doc, auto_doc, out, remove_singletons)
         for error in errors:
-            counts[error[0]].append(error)
+            counts[error[0]] += 1
 
     # Print a summary of the changes and errors
     order = [
@@ -1061,7 +990,7 @@ if __name__ == '__main__':
         if key is None:
             print(text, file=out['summary'])
         else:
-            print("%6d   %s" % (len(counts[key]), text), file=out['summary'])
+            print("%6d   %s" % (counts[key], text), file=out['summary'])
 
     for name in out:
         out[name].close()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from array import array
+
+from .pstree import PSTree
+
+class ArrayTree:
+    '''Phrase Structure Tree stored as parallel arrays, with one entry per node
+    in pre-order (so the root is node 0).  Nodes are referred to by their
+    index.  For each node the arrays hold the label id (an index into
+    label_names), the span, the parent and the first child and next sibling
+    (-1 where there is none).  words holds the word of each terminal, in order.
+    Spans are those of the PSTree the arrays were built from.
+
+    >>> from .pstree import tree_from_text
+    >>> tree = tree_from_text("(ROOT (S (NP-SBJ (NNP Ms.) (NNP Haag) ) (VP (VBZ plays) (NP (NNP Elianti) )) (. .) ))")
+    >>> atree = array_tree_from_pstree(tree)
+    >>> print(atree)
+    (ROOT (S (NP-SBJ (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti))) (. .)))
+    >>> atree.word_yield()
+    'Ms. Haag plays Elianti .'
+    >>> node = atree.get_nodes('lowest', 2, 4)
+    >>> atree.label(node), atree.span(node), atree.word_yield(node=node)
+    ('VP', (2, 4), 'plays Elianti')
+    >>> [atree.label(node) for node in atree.get_nodes('all', 3, 4)]
+    ['NP', 'NNP']
+    >>> [atree.label(node) for node in atree.get_spanning_nodes(1, 4)]
+    ['NNP', 'VP']
+    >>> [atree.label(node) for node in atree.children(atree.parent[node])]
+    ['NP-SBJ', 'VP', '.']
+    >>> [atree.word(node) for node in atree.subtree_nodes(node)]
+    [None, 'plays', None, 'Elianti']
+    >>> print(atree.to_pstree())
+    (ROOT (S (NP-SBJ (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti))) (. .)))
+    '''
+    def __init__(self):
+        self.label_names = []
+        self.label_ids = array('i')
+        self.starts = array('i')
+        self.ends = array('i')
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.words = []
+
+    def __len__(self):
+        return len(self.label_ids)
+
+    def __iter__(self):
+        '''Iterate over the nodes in pre-order.'''
+        return iter(range(len(self.label_ids)))
+
+    def __repr__(self):
+        return repr(self.to_pstree())
+
+    def label(self, node):
+        return self.label_names[self.label_ids[node]]
+
+    def span(self, node):
+        return (self.starts[node], self.ends[node])
+
+    def is_terminal(self, node):
+        return self.first_child[node] < 0
+
+    def word(self, node):
+        if self.first_child[node] >= 0:
+            return None
+        return self.words[self.starts[node] - self.starts[0]]
+
+    def children(self, node):
+        '''Iterate over the children of a node, left to right.'''
+        child = self.first_child[node]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    def subtree_nodes(self, node=0):
+        '''The nodes of the subtree below a node, in pre-order.'''
+        return range(node, self.subtree_end(node))
+
+    def subtree_end(self, node):
+        '''The index after the last node in the subtree below this node.'''
+        while node >= 0 and self.next_sibling[node] < 0:
+            node = self.parent[node]
+        if node < 0:
+            return len(self.label_ids)
+        return self.next_sibling[node]
+
+    def get_nodes(self, request='all', start=-1, end=-1):
+        '''Get the node(s) that have a given span, as for PSTree.get_nodes.
+        Unspecified endpoints are treated as wildcards.  The request can be
+        'lowest', 'highest', or 'all'.  For 'all', the list of nodes is in order
+        from the highest first.'''
+        if request not in ['highest', 'lowest', 'all']:
+            raise Exception("%s is not a valid request" % str(request))
+        if request == 'lowest' and start < 0 and end < 0:
+            raise Exception("Lowest is not well defined when both ends are wildcards")
+
+        # Nodes that match a fixed endpoint all lie on one path from the root,
+        # so pre-order puts them highest first.  With two wildcards every node
+        # matches, and the order is that of PSTree.get_nodes, parents before
+        # their children, later siblings first.
+        if start < 0 and end < 0:
+            if request == 'highest':
+                return 0
+            ans = []
+            stack = [0]
+            while len(stack) > 0:
+                node = stack.pop()
+                ans.append(node)
+                stack.extend(self.children(node))
+            return ans
+
+        ans = []
+        starts, ends = self.starts, self.ends
+        node = 0
+        while node >= 0:
+            if (starts[node] == start or start < 0) and (ends[node] == end or end < 0):
+                if request == 'highest':
+                    return node
+                ans.append(node)
+            # Move to the child that contains the requested endpoint
+            child = self.first_child[node]
+            node = -1
+            while child >= 0:
+                if starts[child] <= start < ends[child] or (start < 0 and starts[child] < end <= ends[child]):
+                    node = child
+                    break
+                child = self.next_sibling[child]
+        if request == 'all':
+            return ans
+        if len(ans) == 0:
+            return None
+        return ans[-1]
+
+    def get_spanning_nodes(self, start, end):
+        '''Get the highest nodes that together cover exactly the span, left to
+        right, or None if the span cannot be covered, as for
+        PSTree.get_spanning_nodes.'''
+        ans = []
+        starts, ends = self.starts, self.ends
+        stack = [0]
+        while len(stack) > 0 and start != end:
+            node = stack.pop()
+            if node != 0 and ends[node] < start:
+                continue
+            if starts[node] == start and ends[node] <= end:
+                ans.append(node)
+                start = ends[node]
+            else:
+                stack.extend(reversed(list(self.children(node))))
+        if start == end:
+            return ans
+        return None
+
+    def word_yield(self, span=None, as_list=False, node=0):
+        '''Return the words at terminal nodes below a node (the root by
+        default) that are within the span, either as a space separated string,
+        or as a list.'''
+        first, last = self.starts[node], self.ends[node]
+        if span is not None:
+            first = max(first, span[0])
+            last = min(last, span[1])
+        offset = self.starts[0]
+        words = [word for word in self.words[first - offset:last - offset] if word is not None]
+        if self.first_child[node] < 0 and len(words) == 0:
+            return None
+        if as_list:
+            return words
+        return ' '.join(words)
+
+    def to_pstree(self):
+        '''Build the equivalent PSTree.'''
+        trees = []
+        for node in range(len(self.label_ids)):
+            tree = PSTree(self.word(node), self.label(node), self.span(node))
+            if node > 0:
+                parent = trees[self.parent[node]]
+                tree.parent = parent
+                parent.subtrees.append(tree)
+            trees.append(tree)
+        if len(trees) == 0:
+            return None
+        return trees[0]
+
+def array_tree_from_pstree(tree):
+    '''Build an ArrayTree with the same nodes, labels, spans and words as the
+    given PSTree.'''
+    ans = ArrayTree()
+    label_index = {}
+    # Depth first, with each node's entry added before its subtrees
+    stack = [(tree, -1)]
+    prev_child = {}
+    while len(stack) > 0:
+        cur, parent = stack.pop()
+        node = len(ans.label_ids)
+        if cur.label not in label_index:
+            label_index[cur.label] = len(ans.label_names)
+            ans.label_names.append(cur.label)
+        ans.label_ids.append(label_index[cur.label])
+        ans.starts.append(cur.span[0])
+        ans.ends.append(cur.span[1])
+        ans.parent.append(parent)
+        ans.first_child.append(-1)
+        ans.next_sibling.append(-1)
+        if parent >= 0:
+            if parent in prev_child:
+                ans.next_sibling[prev_child[parent]] = node
+            else:
+                ans.first_child[parent] = node
+            prev_child[parent] = node
+        if len(cur.subtrees) == 0:
+            ans.words.append(cur.word)
+        for subtree in reversed(cur.subtrees):
+            stack.append((subtree, node))
+    return ans
+
+
+if __name__ == '__main__':
+    print("Running doctest")
+    import doctest
+    doctest.testmod()
@@ -3,55 +3,166 @@
 # vim: set ts=2 sw=2 noet:
 
 import sys
-from collections import defaultdict
+from collections import defaultdict, Counter
 import string
 
 from .head_finder import get_head
 
 # TODO: Look into semantic head finding (current is syntactically biased)
 
-def confusion_groups(gold_mentions, auto_mentions, gold_clusters, auto_clusters):
-    groups = []
+class DisjointSets:
+    '''Union-find over hashable items, with union by size and path halving.
+    Items that have not been seen before are each in a set of their own.
+
+    >>> sets = DisjointSets()
+    >>> sets.union(1, 2), sets.union(3, 4)
+    (1, 3)
+    >>> sets.find(1) == sets.find(2), sets.find(2) == sets.find(3)
+    (True, False)
+    >>> sets.union(2, 4)
+    1
+    >>> sets.find(1) == sets.find(3), sets.count(4), sets.count(5)
+    (True, 4, 1)
+    '''
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, item):
+        parent = self.parent
+        up = parent.get(item, item)
+        while up != item:
+            top = parent.get(up, up)
+            parent[item] = top
+            item = top
+            up = parent.get(item, item)
+        return item
+
+    def count(self, item):
+        '''The number of items in the set containing item.'''
+        return self.size.get(self.find(item), 1)
+
+    def union(self, item1, item2):
+        root1 = self.find(item1)
+        root2 = self.find(item2)
+        if root1 == root2:
+            return root1
+        size1 = self.size.get(root1, 1)
+        size2 = self.size.get(root2, 1)
+        if size1 < size2:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] = size1 + size2
+        return root1
+
+def confusion_group_ids(gold_mentions, auto_mentions, gold_clusters, auto_clusters):
+    '''Group the clusters that share mentions, returning a list of (auto,
+    gold) pairs of lists of cluster IDs.  Groups are found with union-find
+    over the gold cluster IDs, and are listed in the order the original
+    depth-first search gave: each group is started from the first of its
+    mentions in a set of all the mentions (gold first), and clusters within
+    it are in depth-first order from that mention's cluster.  Only groups with
+    more than one cluster on a side need the search to order them.
+
+    >>> gold_clusters = {1: [(0, 0, 1), (0, 2, 3)], 2: [(1, 0, 2)]}
+    >>> auto_clusters = {5: [(0, 0, 1)], 6: [(0, 2, 3)], 7: [(2, 0, 1)]}
+    >>> gold_mentions = {(0, 0, 1): 1, (0, 2, 3): 1, (1, 0, 2): 2}
+    >>> auto_mentions = {(0, 0, 1): 5, (0, 2, 3): 6, (2, 0, 1): 7}
+    >>> sorted(confusion_group_ids(gold_mentions, auto_mentions, gold_clusters, auto_clusters))
+    [([], [2]), ([6, 5], [1]), ([7], [])]
+    '''
+    # Union gold clusters that share a system cluster, and note one gold
+    # cluster for each system cluster that has any gold mentions
+    sets = DisjointSets()
+    auto_to_gold = {}
+    for mention, gold_cluster in gold_mentions.items():
+        auto_cluster = auto_mentions.get(mention)
+        if auto_cluster is not None:
+            prev = auto_to_gold.setdefault(auto_cluster, gold_cluster)
+            if prev != gold_cluster:
+                sets.union(prev, gold_cluster)
+    linked_auto = defaultdict(list)
+    for auto_cluster, gold_cluster in auto_to_gold.items():
+        linked_auto[gold_cluster].append(auto_cluster)
+
+    # The set is built one mention at a time so that its iteration order is
+    # the same as in earlier versions, keeping the output order unchanged
     mentions = set()
     for mention in gold_mentions:
         mentions.add(mention)
     for mention in auto_mentions:
         mentions.add(mention)
-    while len(mentions) > 0:
-        # Choose a random mention and DFS to create the confusion group
-        auto = []
-        gold = []
-        seed = mentions.pop()
-        stack = []
-        seen_gold = set()
-        seen_auto = set()
-        if seed in gold_mentions:
-            stack.append((gold_mentions[seed], True))
-            seen_gold.add(stack[0][0])
+
+    # Clusters are marked as done once their group has been listed
+    groups = []
+    done_gold = set()
+    done_auto = set()
+    for seed in mentions:
+        gold_cluster = gold_mentions.get(seed)
+        if gold_cluster is None:
+            auto_cluster = auto_mentions[seed]
+            if auto_cluster in done_auto:
+                continue
+            gold_cluster = auto_to_gold.get(auto_cluster)
+            if gold_cluster is None:
+                # A system cluster with no gold mentions is a group by itself
+                done_auto.add(auto_cluster)
+                groups.append(([auto_cluster], []))
+                continue
+            start = (auto_cluster, False)
+        elif gold_cluster in done_gold:
+            continue
+        else:
+            start = (gold_cluster, True)
+        # A gold cluster that is alone in its set has all the group's system
+        # clusters linked to it
+        auto = linked_auto.get(gold_cluster, [])
+        if len(auto) <= 1 and sets.count(gold_cluster) == 1:
+            group = (list(auto), [gold_cluster])
         else:
-            stack.append((auto_mentions[seed], False))
-            seen_auto.add(stack[0][0])
-
-        while len(stack) > 0:
-            cluster, is_gold = stack.pop()
-            if is_gold:
-                gold.append(set(gold_clusters[cluster]))
-                for mention in gold_clusters[cluster]:
-                    auto_cluster = auto_mentions.get(mention)
-                    if auto_cluster is not None:
-                        if auto_cluster not in seen_auto:
-                            stack.append((auto_cluster, False))
-                            seen_auto.add(auto_cluster)
-                    mentions.discard(mention)
-            else:
-                auto.append(set(auto_clusters[cluster]))
-                for mention in auto_clusters[cluster]:
-                    gold_cluster = gold_mentions.get(mention)
-                    if gold_cluster is not None:
-                        if gold_cluster not in seen_gold:
-                            stack.append((gold_cluster, True))
-                            seen_gold.add(gold_cluster)
-                    mentions.discard(mention)
+            group = confusion_group_search(start, gold_mentions, auto_mentions, gold_clusters, auto_clusters)
+        done_auto.update(group[0])
+        done_gold.update(group[1])
+        groups.append(group)
+    return groups
+
+def confusion_group_search(start, gold_mentions, auto_mentions, gold_clusters, auto_clusters):
+    '''List the clusters of a group in depth-first order from start, a
+    (cluster ID, is gold) pair.'''
+    auto = []
+    gold = []
+    stack = [start]
+    seen_gold = set()
+    seen_auto = set()
+    if start[1]:
+        seen_gold.add(start[0])
+    else:
+        seen_auto.add(start[0])
+    while len(stack) > 0:
+        cluster, is_gold = stack.pop()
+        if is_gold:
+            gold.append(cluster)
+            for mention in gold_clusters[cluster]:
+                auto_cluster = auto_mentions.get(mention)
+                if auto_cluster is not None and auto_cluster not in seen_auto:
+                    stack.append((auto_cluster, False))
+                    seen_auto.add(auto_cluster)
+        else:
+            auto.append(cluster)
+            for mention in auto_clusters[cluster]:
+                gold_cluster = gold_mentions.get(mention)
+                if gold_cluster is not None and gold_cluster not in seen_gold:
+                    stack.append((gold_cluster, True))
+                    seen_gold.add(gold_cluster)
+    return auto, gold
+
+def confusion_groups(gold_mentions, auto_mentions, gold_clusters, auto_clusters):
+    '''Group the clusters that share mentions, as for confusion_group_ids,
+    but with each cluster as a set of mentions.'''
+    groups = []
+    for auto, gold in confusion_group_ids(gold_mentions, auto_mentions, gold_clusters, auto_clusters):
+        auto = [set(auto_clusters[cluster]) for cluster in auto]
+        gold = [set(gold_clusters[cluster]) for cluster in gold]
         groups.append((auto, gold))
     return groups
 
@@ -66,7 +177,10 @@ def mention_head(mention, text, parses, heads, default_last=True):
     return get_head(heads[sentence], node)
 
 def mention_type(mention, text, parses, heads):
-    head_span, head_word, head_pos = mention_head(mention, text, parses, heads)
+    return head_mention_type(mention, mention_head(mention, text, parses, heads))
+
+def head_mention_type(mention, head):
+    head_span, head_word, head_pos = head
     if mention[2] - mention[1] == 1 and (head_pos in ["PRP", "PRP$", "WP", "WP$", "WDT", "WRB", "DT"] or head_word.lower() in pronoun_properties):
         return "pronoun"
     elif head_pos in ["NNP", "NNPS"]:
@@ -79,6 +193,420 @@ def mention_text(mention, text):
     ans = text[sentence][start:end]
     return ' '.join(ans)
 
+def trimmed_span(mention, text):
+    '''The mention with a leading "the" or punctuation and trailing "'s" or
+    punctuation removed (always leaving at least one word).
+
+    >>> text = [['Yesterday', ',', 'the', 'council', "'s", '.']]
+    >>> trimmed_span((0, 1, 6), text)
+    (0, 3, 4)
+    '''
+    sentence, start, end = mention
+    words = text[sentence]
+    while (start < end - 1 and
+           (words[start] == "the" or
+           (len(words[start]) == 1 and
+           words[start][0] not in string.ascii_letters))):
+        start += 1
+    while (start < end - 1 and
+           (words[end - 1] == "'s" or
+           (len(words[end - 1]) == 1 and
+           words[end - 1][0] not in string.ascii_letters))):
+        end -= 1
+    return (sentence, start, end)
+
+def match_trimmed_spans(unique_to_auto, unique_to_gold, text):
+    '''Map system mentions to gold mentions that are the same once trimmed.
+    Each system mention takes all the unused gold mentions that match it, and
+    is mapped to the last of them (in the iteration order of
+    unique_to_gold).'''
+    gold_by_span = defaultdict(list)
+    for gmention in unique_to_gold:
+        gold_by_span[trimmed_span(gmention, text)].append(gmention)
+    mapping = {}
+    for amention in unique_to_auto:
+        gmentions = gold_by_span.pop(trimmed_span(amention, text), None)
+        if gmentions is not None:
+            mapping[amention] = gmentions[-1]
+    return mapping
+
+# Mentions can be packed into a single integer, with the sentence, start and
+# end in fixed width fields, so that integer order is the same as tuple order.
+MENTION_FIELD_BITS = 21
+MENTION_FIELD_MASK = (1 << MENTION_FIELD_BITS) - 1
+
+def encode_mention(mention):
+    '''Pack a (sentence, start, end) mention into an int that fits in 64 bits.
+
+    >>> encode_mention((1, 2, 3)) < encode_mention((1, 3, 4)) < encode_mention((2, 0, 1))
+    True
+    >>> decode_mention(encode_mention((12, 4, 7)))
+    (12, 4, 7)
+    '''
+    sentence, start, end = mention
+    for value in mention:
+        if value < 0 or value > MENTION_FIELD_MASK:
+            raise Exception("Mention %s can not be encoded" % str(mention))
+    return (((sentence << MENTION_FIELD_BITS) | start) << MENTION_FIELD_BITS) | end
+
+def decode_mention(code):
+    '''Unpack a mention made by encode_mention.'''
+    end = code & MENTION_FIELD_MASK
+    code >>= MENTION_FIELD_BITS
+    start = code & MENTION_FIELD_MASK
+    return (code >> MENTION_FIELD_BITS, start, end)
+
+def encode_mentions(mentions):
+    '''Encode the mentions used as keys of a dictionary (such as a mention to
+    cluster ID mapping), or in a set or list.
+
+    >>> mentions = {(0, 2, 3): 1, (0, 0, 1): 1, (3, 1, 4): 2}
+    >>> codes = encode_mentions(mentions)
+    >>> sorted(decode_mentions(sorted(codes))) == sorted(mentions)
+    True
+    >>> decode_mentions(codes) == mentions
+    True
+    >>> decode_mentions(encode_mentions({(1, 0, 1), (0, 5, 6)})) == {(1, 0, 1), (0, 5, 6)}
+    True
+    '''
+    if isinstance(mentions, dict):
+        ans = {}
+        for mention in mentions:
+            ans[encode_mention(mention)] = mentions[mention]
+        return ans
+    return type(mentions)([encode_mention(mention) for mention in mentions])
+
+def decode_mentions(codes):
+    '''Reverse encode_mentions, for use when printing.'''
+    if isinstance(codes, dict):
+        ans = {}
+        for code in codes:
+            ans[decode_mention(code)] = codes[code]
+        return ans
+    return type(codes)([decode_mention(code) for code in codes])
+
+class MentionFeatures:
+    '''Properties of the mentions in a document, worked out the first time a
+    mention is asked about and then stored, so repeated queries do not search
+    the parse again.  For each mention, features holds a tuple of the head
+    (span, word, POS), the type, the lowercased text, the pronoun gender,
+    number and person, and the NER label (None if there is none).'''
+    def __init__(self, text, parses, heads, ner=None):
+        self.text = text
+        self.parses = parses
+        self.heads = heads
+        self.ner_labels = ner if ner is not None else {}
+        self.features = {}
+        self.summaries = {}
+
+    def get(self, mention):
+        ans = self.features.get(mention)
+        if ans is None:
+            head = mention_head(mention, self.text, self.parses, self.heads, default_last=True)
+            mtext = mention_text(mention, self.text).lower()
+            gender, number, person = pronoun_properties_text(mtext)
+            ans = (head, head_mention_type(mention, head), mtext, gender, number, person, self.ner_labels.get(mention))
+            self.features[mention] = ans
+        return ans
+
+    def head(self, mention):
+        return self.get(mention)[0]
+
+    def head_word(self, mention):
+        return self.get(mention)[0][1].lower()
+
+    def type(self, mention):
+        return self.get(mention)[1]
+
+    def text_lower(self, mention):
+        return self.get(mention)[2]
+
+    def pronoun_properties(self, mention):
+        return self.get(mention)[3:6]
+
+    def ner(self, mention):
+        return self.get(mention)[6]
+
+    def cluster(self, cluster):
+        '''The ClusterSummary of a set of mentions, shared by every query about
+        a cluster with the same mentions.'''
+        key = frozenset(cluster)
+        ans = self.summaries.get(key)
+        if ans is None:
+            ans = ClusterSummary(key, self)
+            self.summaries[key] = ans
+        return ans
+
+    def rest(self, cluster, part):
+        '''The properties of the mentions in cluster that are not in part, found
+        from the summaries of the two.  These are not stored, as there is a
+        different rest for every part of a cluster.'''
+        whole = self.cluster(cluster)
+        inside = [mention for mention in part if mention in whole.mentions]
+        if len(inside) == len(part):
+            part = self.cluster(part)
+        else:
+            part = ClusterSummary(inside, self)
+        return SummaryDifference(whole, part)
+
+class ClusterSummary:
+    '''Aggregate properties of a set of mentions, each a Counter: the NER
+    labels and pronoun numbers, persons and genders (excluding unknowns), the
+    mention types, and the lowercased texts and head words, both overall and
+    for the mentions that are not pronouns.
+
+    >>> from .pstree import tree_from_text
+    >>> from .head_finder import collins_find_heads
+    >>> parse = tree_from_text("(ROOT (S (NP (NNP Mary)) (VP (VBD said) (SBAR (S (NP (PRP she)) (VP (VBD saw) (NP (NNP Mary))))))))")
+    >>> features = MentionFeatures([parse.word_yield(as_list=True)], [parse], [collins_find_heads(parse)])
+    >>> whole = features.cluster({(0, 0, 1), (0, 2, 3), (0, 4, 5)})
+    >>> whole.count('types', 'name'), whole.count('types', 'pronoun')
+    (2, 1)
+    >>> rest = features.rest({(0, 0, 1), (0, 2, 3), (0, 4, 5)}, {(0, 4, 5)})
+    >>> rest.has('texts', 'mary'), rest.labels('number')
+    (True, {'single'})
+    >>> rest = features.rest({(0, 0, 1), (0, 2, 3), (0, 4, 5)}, {(0, 0, 1), (0, 4, 5)})
+    >>> rest.has('texts', 'mary'), rest.shares('heads', features.cluster({(0, 0, 1)}))
+    (False, False)
+    '''
+    def __init__(self, mentions, features):
+        self.mentions = mentions
+        self.features = features
+        self.ner, self.number, self.person, self.gender = Counter(), Counter(), Counter(), Counter()
+        self.types = Counter()
+        self.texts, self.heads = Counter(), Counter()
+        self.non_pronoun_texts, self.non_pronoun_heads = Counter(), Counter()
+        self.non_pronoun = None
+        for mention in mentions:
+            head, mtype, mtext, gender, number, person, ner = features.get(mention)
+            if gender != 'unknown':
+                self.gender[gender] += 1
+            if number != 'unknown':
+                self.number[number] += 1
+            if person != 'unknown':
+                self.person[person] += 1
+            if ner is not None:
+                self.ner[ner] += 1
+            self.types[mtype] += 1
+            head_word = head[1].lower()
+            self.texts[mtext] += 1
+            self.heads[head_word] += 1
+            if mtype != 'pronoun':
+                self.non_pronoun_texts[mtext] += 1
+                self.non_pronoun_heads[head_word] += 1
+                if self.non_pronoun is None or self.non_pronoun > mention:
+                    self.non_pronoun = mention
+        self.non_pronoun_head = False
+
+    def count(self, field, key):
+        return getattr(self, field)[key]
+
+    def has(self, field, key):
+        return getattr(self, field)[key] > 0
+
+    def labels(self, field):
+        '''The set of values of a field.'''
+        return set(getattr(self, field))
+
+    def shares(self, field, other):
+        '''Whether some value of a field is also a value of it in the other
+        summary.'''
+        values = getattr(self, field)
+        for key in getattr(other, field):
+            if values[key] > 0:
+                return True
+        return False
+
+    def min_non_pronoun(self, check_head=False):
+        '''The first mention that is not a pronoun, optionally also skipping
+        mentions with a head that is a pronoun, or None if there is none.'''
+        if not check_head:
+            return self.non_pronoun
+        if self.non_pronoun_head is False:
+            ans = None
+            for mention in self.mentions:
+                if self.features.type(mention) == 'pronoun':
+                    continue
+                head = self.features.head(mention)
+                if self.features.type((mention[0], head[0][0], head[0][1])) == 'pronoun':
+                    continue
+                if ans is None or ans > mention:
+                    ans = mention
+            self.non_pronoun_head = ans
+        return self.non_pronoun_head
+
+class SummaryDifference:
+    '''The properties of the mentions in one ClusterSummary but not in another
+    that covers a subset of its mentions, answered by subtracting counts.
+    Apart from labels, queries only look at the values in the query or in the
+    smaller summary, so they take time proportional to the part, not the
+    cluster.'''
+    def __init__(self, whole, part):
+        self.whole = whole
+        self.part = part
+
+    def count(self, field, key):
+        return getattr(self.whole, field)[key] - getattr(self.part, field)[key]
+
+    def has(self, field, key):
+        return self.count(field, key) > 0
+
+    def labels(self, field):
+        '''The set of values of a field (cheap for the small label fields).'''
+        removed = getattr(self.part, field)
+        return {key for key, count in getattr(self.whole, field).items() if count > removed[key]}
+
+    def shares(self, field, other):
+        for key in getattr(other, field):
+            if self.count(field, key) > 0:
+                return True
+        return False
+
+class MentionOverlay:
+    '''A mention to cluster ID mapping stored as changes over a base mapping,
+    which must not be modified while the overlay is in use.  It behaves like a
+    copy of the base, including the order of iteration (entries that are
+    added, or removed and added again, come after those of the base).
+
+    The IDs stored for mentions are nodes in a disjoint-set forest, and the ID
+    a mention has is the label of the root of its node's set (by default a
+    node is its own root and label).  This means relabel can merge one
+    cluster into another without visiting their mentions.
+
+    >>> base = {(0, 0, 1): 1, (0, 2, 3): 1, (1, 0, 2): 2}
+    >>> view = MentionOverlay(base)
+    >>> view[(0, 2, 3)] = 3
+    >>> view.pop((0, 0, 1))
+    1
+    >>> view[(2, 0, 1)] = 4
+    >>> view[(0, 0, 1)] = 5
+    >>> view.relabel(2, 4)
+    >>> view.relabel(4, 1)
+    >>> list(view.items())
+    [((0, 2, 3), 3), ((1, 0, 2), 1), ((2, 0, 1), 1), ((0, 0, 1), 5)]
+    >>> base
+    {(0, 0, 1): 1, (0, 2, 3): 1, (1, 0, 2): 2}
+    '''
+    def __init__(self, base):
+        self.base = base
+        self.changed = {}
+        self.removed = set()
+        self.added = {}
+        self.sets = DisjointSets()
+        self.labels = {}
+        self.roots = {}
+
+    def label(self, node):
+        if len(self.labels) == 0:
+            return node
+        root = self.sets.find(node)
+        return self.labels.get(root, root)
+
+    def root_with_label(self, cluster_id):
+        '''The root of the set of nodes with this label, or None.'''
+        root = self.roots.get(cluster_id)
+        if root is None:
+            root = cluster_id
+        root = self.sets.find(root)
+        if self.labels.get(root, root) == cluster_id:
+            return root
+        return None
+
+    def node_for(self, cluster_id):
+        '''A node that has the given label, making a new one if necessary.'''
+        root = self.root_with_label(cluster_id)
+        if root is None:
+            root = ('relabelled', cluster_id, len(self.labels))
+            self.labels[root] = cluster_id
+            self.roots[cluster_id] = root
+        return root
+
+    def in_base(self, mention):
+        return mention in self.base and mention not in self.removed
+
+    def __contains__(self, mention):
+        return mention in self.added or self.in_base(mention)
+
+    def node(self, mention):
+        if mention in self.added:
+            return self.added[mention]
+        if mention in self.removed:
+            raise KeyError(mention)
+        if mention in self.changed:
+            return self.changed[mention]
+        return self.base[mention]
+
+    def __getitem__(self, mention):
+        return self.label(self.node(mention))
+
+    def get(self, mention, default=None):
+        if mention in self:
+            return self[mention]
+        return default
+
+    def __setitem__(self, mention, cluster_id):
+        node = self.node_for(cluster_id)
+        if mention not in self.added and self.in_base(mention):
+            self.changed[mention] = node
+        else:
+            self.added[mention] = node
+
+    def pop(self, mention):
+        if mention in self.added:
+            node = self.added.pop(mention)
+        elif self.in_base(mention):
+            self.removed.add(mention)
+            node = self.changed.pop(mention, self.base[mention])
+        else:
+            raise KeyError(mention)
+        return self.label(node)
+
+    def relabel(self, old_id, new_id):
+        '''Change the cluster ID of every mention in cluster old_id to new_id.'''
+        if old_id == new_id:
+            return
+        old_root = self.root_with_label(old_id)
+        if old_root is None:
+            return
+        self.roots.pop(old_id, None)
+        new_root = self.root_with_label(new_id)
+        root = old_root
+        if new_root is not None:
+            root = self.sets.union(old_root, new_root)
+        self.labels[root] = new_id
+        self.roots[new_id] = root
+
+    def __len__(self):
+        return len(self.base) - len(self.removed) + len(self.added)
+
+    def __iter__(self):
+        removed = self.removed
+        for mention in self.base:
+            if mention not in removed:
+                yield mention
+        for mention in self.added:
+            yield mention
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        '''Iterate over (mention, cluster ID) pairs, finding the ID for each
+        node only once.'''
+        removed = self.removed
+        changed = self.changed
+        labels = {}
+        for mention, node in self.base.items():
+            if mention not in removed:
+                node = changed.get(mention, node)
+                if node not in labels:
+                    labels[node] = self.label(node)
+                yield mention, labels[node]
+        for mention, node in self.added.items():
+            if node not in labels:
+                labels[node] = self.label(node)
+            yield mention, labels[node]
+
 def set_of_clusters(clusters):
     ans = set()
     for cluster in clusters:
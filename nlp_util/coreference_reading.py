@@ -4,38 +4,72 @@
 
 import sys, os
 import re
+import hashlib, pickle
 import glob, fnmatch
 from collections import defaultdict
-from io import StringIO
+from itertools import chain, tee
 
 from .head_finder import collins_find_heads
-from .treebanks import read_trees, conll_read_tree
+from .treebanks import conll_tree_from_columns
 
-def read_conll_parses(lines):
-    in_file = StringIO(''.join(lines))
-    return read_trees(in_file, conll_read_tree)
-
-def read_conll_text(lines):
-    text = [[]]
+def read_conll_columns(lines):
+    '''Split the lines of a part into the columns used by the readers below,
+    so each line is only split once.  Returns a dict from 'word', 'pos',
+    'parse', 'ner' and 'coref' to a list of sentences, each a list with one
+    value per token (None where a line is too short to have that column).'''
+    words, tags, parse_bits, ner, coref = [[]], [[]], [[]], [[]], [[]]
     for line in lines:
-        fields = line.strip().split()
+        if len(line) > 0 and line[0] == '#':
+            continue
+        fields = line.split()
         if len(fields) == 0:
-            text.append([])
+            for column in (words, tags, parse_bits, ner, coref):
+                column.append([])
+            continue
+        words[-1].append(fields[3])
+        if len(fields) > 5:
+            tags[-1].append(fields[4])
+            parse_bits[-1].append(fields[5])
         else:
-            text[-1].append(fields[3])
-    if len(text[-1]) == 0:
-        text.pop()
-    return text
+            tags[-1].append(None)
+            parse_bits[-1].append(None)
+        ner[-1].append(fields[10] if len(fields) >= 11 else None)
+        coref[-1].append(fields[-1])
+    if len(words[-1]) == 0:
+        for column in (words, tags, parse_bits, ner, coref):
+            column.pop()
+    return {'word': words, 'pos': tags, 'parse': parse_bits, 'ner': ner, 'coref': coref}
+
+def conll_sentence_count(columns):
+    '''The number of sentences that have parses, which stop at the first
+    empty sentence.'''
+    for sentence, words in enumerate(columns['word']):
+        if len(words) == 0:
+            return sentence
+    return len(columns['word'])
+
+def read_conll_parses(lines, columns=None):
+    if columns is None:
+        columns = read_conll_columns(lines)
+    parses = []
+    for sentence in range(conll_sentence_count(columns)):
+        parses.append(conll_tree_from_columns(columns['word'][sentence], columns['pos'][sentence], columns['parse'][sentence]))
+    return parses
+
+def read_conll_text(lines, columns=None):
+    if columns is None:
+        columns = read_conll_columns(lines)
+    return columns['word']
 
-def read_conll_ner(lines):
+def read_conll_ner(lines, columns=None):
+    if columns is None:
+        columns = read_conll_columns(lines)
     info = {}
-    word = 0
-    sentence = 0
     cur = []
-    for line in lines:
-        fields = line.strip().split()
-        if len(fields) >= 11:
-            ner_info = fields[10]
+    for sentence, values in enumerate(columns['ner']):
+        for word, ner_info in enumerate(values):
+            if ner_info is None:
+                continue
             if '(' in ner_info and '*' in ner_info:
                 cur.append((ner_info[1:-1], sentence, word))
             elif '(' in ner_info and ')' in ner_info:
@@ -45,66 +79,72 @@ def read_conll_ner(lines):
                 if sentence != start[1]:
                     print("Something mucked up", sentence, word, start, file=sys.stderr)
                 info[sentence, start[2], word +1] = start[0]
-        word += 1
-        if len(fields) == 0:
-            sentence += 1
-            word = 0
     return info
 
-def read_conll_coref(lines):
+def read_conll_coref(lines, columns=None):
     # Assumes:
     #  - Reading a single part
     #  - If duplicate mentions occur, use the first
-    regex = "([(][0-9]*[)])|([(][0-9]*)|([0-9]*[)])|([|])"
+    # The coreference column is a '|' separated list of '(12' (start), '12)'
+    # (end) and '(12)' (single word) items, or '-'.  It is scanned directly
+    # rather than with a regular expression, matching the same items that
+    #   ([(][0-9]*[)])|([(][0-9]*)|([0-9]*[)])|([|])
+    # would.
+    if columns is None:
+        columns = read_conll_columns(lines)
     mentions = {} # (sentence, start, end+1) -> ID
     clusters = defaultdict(lambda: []) # ID -> list of (sentence, start, end+1)s
-    unmatched_mentions = defaultdict(lambda: [])
+    unmatched_mentions = {} # ID -> stack of start words, for this sentence
 
-    sentence = 0
-    word = 0
-    line_no = 0
-    for line in lines:
-        line_no += 1
-        if len(line) > 0 and line[0] =='#':
-            continue
-        line = line.strip()
-        if len(line) == 0:
-            sentence += 1
-            word = 0
-            unmatched_mentions = defaultdict(lambda: [])
-            continue
-        fields = line.strip().split()
-        for triple in re.findall(regex, fields[-1]):
-            if triple[1] != '':
-                val = int(triple[1][1:])
-                unmatched_mentions[(sentence, val)].append(word)
-            elif triple[0] != '' or triple[2] != '':
-                start = word
-                val = -1
-                if triple[0] != '':
-                    val = int(triple[0][1:-1])
-                else:
-                    val = int(triple[2][:-1])
-                    if (sentence, val) not in unmatched_mentions:
-###                     print(''.join(lines[:20]))
-###                     print(triple)
-###                     print(fields)
-###                     print(line)
-###                     print(line_no, len(lines))
-###                     raise Exception("Ending mention with no start: " + str(val))
-                        print("Ignoring a mention with no start", str(val), line.strip(), line_no, file=sys.stderr)
+    for sentence, values in enumerate(columns['coref']):
+        unmatched_mentions.clear()
+        for word, coref_info in enumerate(values):
+            if coref_info == '-':
+                continue
+            pos = 0
+            length = len(coref_info)
+            while pos < length:
+                char = coref_info[pos]
+                if char == '(':
+                    digits = pos + 1
+                    while digits < length and '0' <= coref_info[digits] <= '9':
+                        digits += 1
+                    val = int(coref_info[pos + 1:digits])
+                    if digits == length or coref_info[digits] != ')':
+                        if val in unmatched_mentions:
+                            unmatched_mentions[val].append(word)
+                        else:
+                            unmatched_mentions[val] = [word]
+                        pos = digits
+                        continue
+                    pos = digits + 1
+                    start = word
+                elif char == ')' or '0' <= char <= '9':
+                    digits = pos
+                    while digits < length and '0' <= coref_info[digits] <= '9':
+                        digits += 1
+                    if digits == length or coref_info[digits] != ')':
+                        pos = digits
+                        continue
+                    val = int(coref_info[pos:digits])
+                    pos = digits + 1
+                    if val not in unmatched_mentions:
+                        print("Ignoring a mention with no start", str(val), coref_info, sentence, word, file=sys.stderr)
                         continue
-                    if len(unmatched_mentions[(sentence, val)]) == 0:
-                        print("No other start available", str(val), line.strip(), line_no, file=sys.stderr)
+                    starts = unmatched_mentions[val]
+                    if len(starts) == 0:
+                        print("No other start available", str(val), coref_info, sentence, word, file=sys.stderr)
                         continue
-                    start = unmatched_mentions[(sentence, val)].pop()
+                    start = starts.pop()
+                else:
+                    pos += 1
+                    continue
                 end = word + 1
                 if (sentence, start, end) in mentions:
                     print("Duplicate mention", sentence, start, end, val, mentions[sentence, start, end], file=sys.stderr)
                 else:
                     mentions[sentence, start, end] = val
                     clusters[val].append((sentence, start, end))
-        word += 1
     for key in unmatched_mentions:
         if len(unmatched_mentions[key]) > 0:
             print("Mention started, but did not end ", str(unmatched_mentions[key]), file=sys.stderr)
@@ -444,47 +484,198 @@ def read_reconcile_coref(filename, gold_text):
         text.pop()
     return {'clusters': clusters, 'mentions': mentions, 'text': text}
 
-def read_conll_doc(filename, ans=None, rtext=True, rparses=True, rheads=True, rclusters=True, rner=True):
-    # Read entire file, inserting into a dictionary:
-    #  key - the #begin <blah> info
-    #  value - a dict, one entry per part, each entry contains:
+NOT_BUILT = object()
+
+class LazyList:
+    '''A fixed length sequence whose items are made by build(index) the first
+    time they are used.'''
+    def __init__(self, length, build):
+        self.items = [NOT_BUILT] * length
+        self.build = build
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        item = self.items[index]
+        if item is NOT_BUILT:
+            if index < 0:
+                index += len(self.items)
+            item = self.build(index)
+            self.items[index] = item
+        return item
+
+    def __iter__(self):
+        for index in range(len(self.items)):
+            yield self[index]
+
+class LazyConllPart(dict):
+    '''The fields of a single part, each of which is only read from the raw
+    lines the first time it is used.  Parses and heads are also built one
+    sentence at a time, so a part with no errors never has its trees built.'''
+    def __init__(self, lines, fields):
+        dict.__init__(self)
+        self.lines = lines
+        self.columns = None
+        self.fields = fields
+
+    def __contains__(self, key):
+        return key in self.fields or dict.__contains__(self, key)
+
+    def __missing__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        if self.columns is None:
+            self.columns = read_conll_columns(self.lines)
+            self.lines = None
+        columns = self.columns
+        if key == 'text':
+            self['text'] = read_conll_text(None, columns)
+        elif key == 'parses':
+            words, tags, parse_bits = columns['word'], columns['pos'], columns['parse']
+            self['parses'] = LazyList(conll_sentence_count(columns), lambda i: conll_tree_from_columns(words[i], tags[i], parse_bits[i]))
+        elif key == 'heads':
+            parses = self['parses']
+            self['heads'] = LazyList(len(parses), lambda i: collins_find_heads(parses[i]))
+        elif key == 'mentions' or key == 'clusters':
+            self['mentions'], self['clusters'] = read_conll_coref(None, columns)
+        elif key == 'ner':
+            self['ner'] = read_conll_ner(None, columns)
+        if all(dict.__contains__(self, field) for field in self.fields):
+            self.columns = None
+        return dict.__getitem__(self, key)
+
+    def load_all(self):
+        '''Build every field, returning them in a plain dict.'''
+        ans = {}
+        for key in self.fields:
+            value = self[key]
+            if isinstance(value, LazyList):
+                value = list(value)
+            ans[key] = value
+        return ans
+
+def read_conll_part(lines, rtext=True, rparses=True, rheads=True, rclusters=True, rner=True):
+    # Wrap the lines of a single part, providing a dict containing:
     #     - text
     #     - parses
     #     - heads
     #     - coreference clusters
-    if ans is None:
-        ans = defaultdict(lambda: {})
+    #     - NER
+    # Each is read on first use (see LazyConllPart).  Without parses (e.g. for
+    # system output) the fields are cheap to build and smaller than the lines,
+    # so they are read straight away and the lines are dropped.
+    if not rparses:
+        info = {}
+        columns = read_conll_columns(lines)
+        if rtext:
+            info['text'] = read_conll_text(None, columns)
+        if rclusters:
+            info['mentions'], info['clusters'] = read_conll_coref(None, columns)
+        if rner:
+            info['ner'] = read_conll_ner(None, columns)
+        return info
+    fields = set()
+    if rtext:
+        fields.add('text')
+    if rparses:
+        fields.add('parses')
+        if rheads:
+            fields.add('heads')
+    if rclusters:
+        fields.update(['mentions', 'clusters'])
+    if rner:
+        fields.add('ner')
+    return LazyConllPart(lines, fields)
+
+def conll_part_keys(line):
+    '''Get the (document, part) pair from a '#begin document' line.'''
+    desc = line.split()
+    location = desc[2].strip('();')
+    keys = (location, desc[-1])
+    if "tc/ch/00/ch" in keys[0] and '9' not in keys[0]:
+        val = int(keys[0].split('_')[-1]) * 10 - 1
+        keys = ("tc/ch/00/ch_%04d" % val, keys[1])
+    return keys
+
+def generate_conll_parts(lines, rtext=True, rparses=True, rheads=True, rclusters=True, rner=True):
     cur = []
     keys = None
-    for line in open(filename):
+    for line in lines:
         if len(line) > 0 and line.startswith('#begin') or line.startswith('#end'):
             if 'begin' in line:
-                desc = line.split()
-                location = desc[2].strip('();')
-                keys = (location, desc[-1])
-                if "tc/ch/00/ch" in keys[0] and '9' not in keys[0]:
-                    val = int(keys[0].split('_')[-1]) * 10 - 1
-                    keys = ("tc/ch/00/ch_%04d" % val, keys[1])
+                keys = conll_part_keys(line)
             if len(cur) > 0:
                 if keys is None:
                     print("Error reading conll file - invalid #begin statemen\n", line, file=sys.stderr)
                 else:
-                    info = {}
-                    if rtext:
-                        info['text'] = read_conll_text(cur)
-                    if rparses:
-                        info['parses'] = read_conll_parses(cur)
-                        if rheads:
-                            info['heads'] = [collins_find_heads(parse) for parse in info['parses']]
-                    if rclusters:
-                        info['mentions'], info['clusters'] = read_conll_coref(cur)
-                    if rner:
-                        info['ner'] = read_conll_ner(cur)
-                    ans[keys[0]][keys[1]] = info
+                    yield keys[0], keys[1], read_conll_part(cur, rtext, rparses, rheads, rclusters, rner)
                     keys = None
             cur = []
         else:
             cur.append(line)
+
+def generate_conll_docs(filename, rtext=True, rparses=True, rheads=True, rclusters=True, rner=True):
+    '''Read a CoNLL file one part at a time, yielding (document, part, info)
+    as soon as each '#end document' line is read.  Only the current part is
+    held in memory.'''
+    return generate_conll_parts(open(filename), rtext, rparses, rheads, rclusters, rner)
+
+def conll_part_offsets(filename):
+    '''Yield (document, part, byte offset of its '#begin document' line) for
+    each part of a file, without reading the parts themselves.'''
+    offset = 0
+    with open(filename, 'rb') as source:
+        for line in source:
+            if line.startswith(b'#begin'):
+                doc, part = conll_part_keys(line.decode('utf-8'))
+                yield doc, part, offset
+            offset += len(line)
+
+def read_conll_part_at(source, offset, doc, part, rtext=True, rparses=True, rheads=True, rclusters=True, rner=True):
+    '''Read the part that starts at offset in an open file, returning None if
+    that is not where the given part starts.'''
+    source.seek(offset)
+    line = source.readline()
+    if line.startswith('#begin') and conll_part_keys(line) == (doc, part):
+        for rdoc, rpart, info in generate_conll_parts(chain([line], source), rtext, rparses, rheads, rclusters, rner):
+            return info
+    return None
+
+def generate_conll_sorted_docs(filename, rtext=True, rparses=True, rheads=True, rclusters=True, rner=True):
+    '''As for generate_conll_docs, but in sorted (document, part) order.  A
+    first pass notes where each part starts, then, if the file is not already
+    in order, each part is read by seeking to it, so only one part is held in
+    memory at a time either way.  As with read_conll_doc, if a part appears
+    more than once the last copy is used.'''
+    offsets = {}
+    in_order = True
+    prev = None
+    for doc, part, offset in conll_part_offsets(filename):
+        key = (doc, part)
+        if key in offsets or (prev is not None and key < prev):
+            in_order = False
+        offsets[key] = offset
+        prev = key
+    if in_order:
+        for doc, part, info in generate_conll_docs(filename, rtext, rparses, rheads, rclusters, rner):
+            yield doc, part, info
+        return
+    with open(filename) as source:
+        for doc, part in sorted(offsets):
+            info = read_conll_part_at(source, offsets[doc, part], doc, part, rtext, rparses, rheads, rclusters, rner)
+            if info is not None:
+                yield doc, part, info
+
+def read_conll_doc(filename, ans=None, rtext=True, rparses=True, rheads=True, rclusters=True, rner=True):
+    # Read entire file, inserting into a dictionary:
+    #  key - the #begin <blah> info
+    #  value - a dict, one entry per part, each entry contains the output of
+    #          read_conll_part
+    if ans is None:
+        ans = defaultdict(lambda: {})
+    for doc, part, info in generate_conll_docs(filename, rtext, rparses, rheads, rclusters, rner):
+        ans[doc][part] = info
     return ans
 
 def read_conll_gold_files(dir_prefix):
@@ -497,27 +688,260 @@ def read_conll_gold_files(dir_prefix):
 def read_conll_coref_system_output(filename, ans=None):
     return read_conll_doc(filename, ans, False, False, False, True)
 
-def read_conll_matching_file(dir_prefix, filename, ans=None):
-    if ans is None:
-        ans = defaultdict(lambda: {})
+def matching_gold_file(dir_prefix, filename, index=None):
+    '''Find the gold file for a document, using the index if it covers it.
+    As with the glob, a document in more than one file is not read.'''
+    if index is not None and filename in index.conflicts:
+        print("Reading matching doc failed for %s/%s as %d files were found." % (dir_prefix, filename, len(index.conflicts[filename])), file=sys.stderr)
+        return None
+    if index is not None and filename in index:
+        for part in index[filename]:
+            path = os.path.join(dir_prefix, index[filename][part][0])
+            if os.path.exists(path):
+                return path
     query = os.path.join(dir_prefix, filename + '*gold*conll')
     filenames = glob.glob(query)
     if len(filenames) == 1:
-        read_conll_doc(filenames[0], ans)
-    else:
-        print("Reading matching doc failed for %s/%s as %d files were found." % (dir_prefix, filename, len(filenames)), file=sys.stderr)
+        return filenames[0]
+    print("Reading matching doc failed for %s/%s as %d files were found." % (dir_prefix, filename, len(filenames)), file=sys.stderr)
+    return None
+
+def read_conll_matching_file(dir_prefix, filename, ans=None, cache_dir=None):
+    if ans is None:
+        ans = defaultdict(lambda: {})
+    gold_file = matching_gold_file(dir_prefix, filename)
+    if gold_file is not None:
+        read_conll_cached_doc(gold_file, cache_dir, ans)
     return ans
 
+def matching_filename(doc):
+    if "tc/ch/00/ch" in doc and '9' not in doc:
+        val = int(doc.split('_')[-1]) * 10 - 1
+        doc = "tc/ch/00/ch_%04d" % val
+    return doc
+
 def read_conll_matching_files(conll_docs, dir_prefix):
     # Read the corresponding file under dir_prefix
     ans = None
     for filename in conll_docs:
-        if "tc/ch/00/ch" in filename and '9' not in filename:
-            val = int(filename.split('_')[-1]) * 10 - 1
-            filename = "tc/ch/00/ch_%04d" % val
-        ans = read_conll_matching_file(dir_prefix, filename, ans)
+        ans = read_conll_matching_file(dir_prefix, matching_filename(filename), ans)
     return ans
 
+CONLL_INDEX_NAME = '.conll_gold_index'
+CONLL_INDEX_VERSION = 2
+
+class ConllIndex(dict):
+    '''Maps document -> part -> (filename relative to the gold directory, byte
+    offset of the '#begin document' line).  files holds the modification time
+    and size of each file when it was read, and conflicts the files of any
+    document found in more than one file, which is left out of the index.'''
+    def __init__(self):
+        dict.__init__(self)
+        self.files = {}
+        self.conflicts = {}
+
+    def is_current(self, dir_prefix, pattern='*gold*conll'):
+        '''True if no gold file has been added, edited, moved or removed since
+        the index was built.'''
+        found = 0
+        for name, path in conll_index_files(dir_prefix, pattern):
+            found += 1
+            if name not in self.files:
+                return False
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if (stat.st_mtime_ns, stat.st_size) != self.files[name]:
+                return False
+        return found == len(self.files)
+
+def conll_index_files(dir_prefix, pattern='*gold*conll'):
+    '''Yield (path relative to dir_prefix, path) for each gold file.'''
+    for root, dirnames, filenames in os.walk(dir_prefix):
+        for filename in fnmatch.filter(filenames, pattern):
+            path = os.path.join(root, filename)
+            yield os.path.relpath(path, dir_prefix), path
+
+def build_conll_index(dir_prefix, pattern='*gold*conll'):
+    '''Walk dir_prefix once, noting where every part starts (see ConllIndex).'''
+    index = ConllIndex()
+    doc_files = defaultdict(set)
+    for name, path in conll_index_files(dir_prefix, pattern):
+        # Stat before reading, so an edit made while reading shows up next time
+        stat = os.stat(path)
+        index.files[name] = (stat.st_mtime_ns, stat.st_size)
+        for doc, part, offset in conll_part_offsets(path):
+            index.setdefault(doc, {})[part] = (name, offset)
+            doc_files[doc].add(name)
+    for doc, names in doc_files.items():
+        if len(names) > 1:
+            index.conflicts[doc] = sorted(names)
+            del index[doc]
+    return index
+
+def save_conll_index(index, filename):
+    '''Write the index to a temporary file and then move it into place, so
+    other runs reading it never see a partly written index.'''
+    tmp_file = filename + '.%d.tmp' % os.getpid()
+    with open(tmp_file, 'w') as out:
+        print("#version\t%d" % CONLL_INDEX_VERSION, file=out)
+        for name in sorted(index.files):
+            mtime, size = index.files[name]
+            print("#file\t%s\t%d\t%d" % (name, mtime, size), file=out)
+        for doc in sorted(index.conflicts):
+            print("#conflict\t%s\t%s" % (doc, '\t'.join(index.conflicts[doc])), file=out)
+        for doc in sorted(index):
+            for part in sorted(index[doc]):
+                name, offset = index[doc][part]
+                print("%s\t%s\t%s\t%d" % (doc, part, name, offset), file=out)
+    os.replace(tmp_file, filename)
+
+def load_conll_index(filename):
+    '''Read a saved index, returning None if it is from an older version or
+    cannot be read.'''
+    index = ConllIndex()
+    with open(filename) as source:
+        if source.readline() != "#version\t%d\n" % CONLL_INDEX_VERSION:
+            return None
+        try:
+            for line in source:
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] == '#file':
+                    index.files[fields[1]] = (int(fields[2]), int(fields[3]))
+                elif fields[0] == '#conflict':
+                    index.conflicts[fields[1]] = fields[2:]
+                else:
+                    doc, part, name, offset = fields
+                    index.setdefault(doc, {})[part] = (name, int(offset))
+        except (ValueError, IndexError):
+            return None
+    return index
+
+def read_conll_index(dir_prefix):
+    '''Load the index saved in dir_prefix, building (and trying to save) it if
+    there is not one yet, or if the gold files have changed since.  Checking
+    only needs a walk of the directory and a stat of each file, not a read.'''
+    filename = os.path.join(dir_prefix, CONLL_INDEX_NAME)
+    if os.path.exists(filename):
+        index = load_conll_index(filename)
+        if index is not None and index.is_current(dir_prefix):
+            return index
+    index = build_conll_index(dir_prefix)
+    try:
+        save_conll_index(index, filename)
+    except (IOError, OSError):
+        print("Unable to save gold index to", filename, file=sys.stderr)
+    return index
+
+def read_conll_indexed_part(dir_prefix, index, doc, part):
+    '''Seek straight to a part using the index.  Returns None if the index does
+    not cover it, or is out of date.'''
+    if doc not in index or part not in index[doc]:
+        return None
+    name, offset = index[doc][part]
+    try:
+        source = open(os.path.join(dir_prefix, name))
+    except IOError:
+        return None
+    with source:
+        return read_conll_part_at(source, offset, doc, part)
+
+CONLL_CACHE_VERSION = 6
+
+def conll_cache_filename(filename, cache_dir):
+    '''The cache entry for a file is named by a hash of its path, modification
+    time and size, so edited files are re-read rather than served stale.'''
+    stat = os.stat(filename)
+    key = "%s\t%d\t%d\t%d" % (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size, CONLL_CACHE_VERSION)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pickle')
+
+def read_conll_cached_doc(filename, cache_dir=None, ans=None):
+    '''As for read_conll_doc, with all fields read, but keeping a binary copy of
+    the processed parts in cache_dir so that later runs can skip parsing.'''
+    if ans is None:
+        ans = defaultdict(lambda: {})
+    if cache_dir is None:
+        return read_conll_doc(filename, ans)
+    cache_file = conll_cache_filename(filename, cache_dir)
+    parts = None
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as source:
+                parts = pickle.load(source)
+        except (pickle.UnpicklingError, EOFError, OSError):
+            # Fall through to parsing the file, which rewrites the entry
+            print("Unable to read cache file", cache_file, file=sys.stderr)
+    if parts is not None:
+        for doc, part, info in parts:
+            clusters = defaultdict(lambda: [])
+            clusters.update(info['clusters'])
+            info['clusters'] = clusters
+            ans[doc][part] = info
+        return ans
+
+    parts = []
+    for doc, part, info in generate_conll_docs(filename):
+        ans[doc][part] = info
+        # The cluster defaultdict has a lambda as its factory, so it cannot be
+        # pickled directly
+        to_save = info.load_all()
+        to_save['clusters'] = dict(info['clusters'])
+        parts.append((doc, part, to_save))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = cache_file + '.%d.tmp' % os.getpid()
+        with open(tmp_file, 'wb') as out:
+            pickle.dump(parts, out, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except (IOError, OSError):
+        print("Unable to write cache file", cache_file, file=sys.stderr)
+    return ans
+
+def generate_conll_matching_docs(order, dir_prefix, index=None, cache_dir=None):
+    '''For each (document, part) in order, yield (document, part, info), where
+    info is the matching gold part under dir_prefix, or None if it could not be
+    found.  With an index (see read_conll_index) each part is read directly,
+    unless a cache_dir is given, in which case whole gold files are read via
+    read_conll_cached_doc.  Otherwise each gold file is read when the first of
+    its parts is requested and dropped once a different document is reached,
+    so order should keep the parts of a document together (e.g. by being
+    sorted).'''
+    cur_doc = None
+    parts = {}
+    for doc, part in order:
+        if index is not None and cache_dir is None:
+            info = read_conll_indexed_part(dir_prefix, index, doc, part)
+            if info is not None:
+                yield doc, part, info
+                continue
+        if doc != cur_doc:
+            cur_doc = doc
+            parts = {}
+            name = matching_filename(doc)
+            gold_file = matching_gold_file(dir_prefix, name, index)
+            if gold_file is not None:
+                parts = read_conll_cached_doc(gold_file, cache_dir).get(doc, {})
+            if not parts and gold_file is not None and index is not None:
+                # The indexed file no longer holds the document, so search for
+                # it as if there were no index
+                glob_file = matching_gold_file(dir_prefix, name)
+                if glob_file is not None and os.path.normpath(glob_file) != os.path.normpath(gold_file):
+                    parts = read_conll_cached_doc(glob_file, cache_dir).get(doc, {})
+        yield doc, part, parts.get(part)
+
+def generate_conll_system_and_gold_docs(filename, dir_prefix, index=None, cache_dir=None):
+    '''For each part of the system output in filename, in sorted order, yield
+    (document, part, system info, gold info), with the gold info found as for
+    generate_conll_matching_docs (None if it is missing).  Only coreference is
+    read from the system output (its NER column is not used), and only the current part of it is held in
+    memory.'''
+    auto_parts, keys = tee(generate_conll_sorted_docs(filename, False, False, False, True, False))
+    order = ((doc, part) for doc, part, info in keys)
+    gold_parts = generate_conll_matching_docs(order, dir_prefix, index, cache_dir)
+    for (doc, part, auto_doc), (gdoc, gpart, gold_doc) in zip(auto_parts, gold_parts):
+        yield doc, part, auto_doc, gold_doc
+
 def read_conll_all(dir_prefix, suffix="auto_conll"):
     ans = None
     for root, dirnames, filenames in os.walk(dir_prefix):
@@ -2,12 +2,12 @@
 # -*- coding: utf-8 -*-
 # vim: set ts=2 sw=2 noet:
 
-import sys, string
+import sys
 from collections import defaultdict
 
 from .render_tree import text_tree
 from .head_finder import get_head
-from .coreference import mention_head
+from .coreference import mention_head, match_trimmed_spans
 
 # TODO:
 # Add ordering information for the context printing
@@ -19,42 +19,11 @@ ANSI_WHITE = 15
 ANSI_YELLOW = 3
 ANSI_RED = 1
 
-def match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clusters, auto_cluster_set, text, parses, heads):
-    # Apply changes for cases where the difference is only leading or trailing punctuation
-    mapping = {}
-    used_gold = set()
-    unique_to_gold = gold_mention_set.difference(auto_mention_set)
-    unique_to_auto =  auto_mention_set.difference(gold_mention_set)
-    for amention in unique_to_auto:
-        sentence, astart, aend = amention
-        while (aend - astart > 1 and
-               (text[sentence][astart] == "the" or
-               (len(text[sentence][astart]) == 1 and
-               text[sentence][astart][0] not in string.ascii_letters))):
-            astart += 1
-        while (aend - astart > 1 and
-               (text[sentence][aend - 1] == "'s" or
-               (len(text[sentence][aend - 1]) == 1 and
-               text[sentence][aend - 1][0] not in string.ascii_letters))):
-            aend -= 1
-        for gmention in unique_to_gold:
-            gsentence, gstart, gend = gmention
-            if sentence != gsentence or gmention in used_gold:
-                continue
-            while (gend - gstart > 1 and
-                   (text[sentence][gstart] == "the" or
-                   (len(text[sentence][gstart]) == 1 and
-                   text[sentence][gstart][0] not in string.ascii_letters))):
-                gstart += 1
-            while (gend - gstart > 1 and
-                   (text[sentence][gend - 1] == "'s" or
-                   (len(text[sentence][gend - 1]) == 1 and
-                   text[sentence][gend - 1][0] not in string.ascii_letters))):
-                gend -= 1
-            if astart == gstart and aend == gend:
-                mapping[amention] = gmention
-                used_gold.add(gmention)
-    # Apply mapping to create new auto_mention_set
+def remap_mentions(mapping, auto_mention_set, auto_mentions, auto_clusters, auto_cluster_set, cluster_index):
+    '''Replace each mention in mapping with the mention it maps to.  The
+    cluster_index maps each mention to a one item list holding the tuple in
+    auto_cluster_set that contains it, with the list shared by all the
+    mentions in the cluster, so that a tuple can be replaced without a search.'''
     for mention in mapping:
         auto_mention_set.remove(mention)
         auto_mention_set.add(mapping[mention])
@@ -62,10 +31,8 @@ def match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clu
         auto_mentions[mapping[mention]] = cluster_id
         auto_clusters[cluster_id].remove(mention)
         auto_clusters[cluster_id].append(mapping[mention])
-        to_remove = None
-        for cluster in auto_cluster_set:
-            if mention in cluster:
-                to_remove = cluster
+        entry = cluster_index.pop(mention)
+        to_remove = entry[0]
         auto_cluster_set.remove(to_remove)
         ncluster = []
         for mention2 in to_remove:
@@ -74,6 +41,22 @@ def match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clu
             ncluster.append(mention2)
         ncluster = tuple(ncluster)
         auto_cluster_set.add(ncluster)
+        entry[0] = ncluster
+        cluster_index[mapping[mention]] = entry
+
+def match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clusters, auto_cluster_set, text, parses, heads):
+    cluster_index = {}
+    for cluster in auto_cluster_set:
+        entry = [cluster]
+        for mention in cluster:
+            cluster_index[mention] = entry
+
+    # Apply changes for cases where the difference is only leading or trailing punctuation
+    unique_to_gold = gold_mention_set.difference(auto_mention_set)
+    unique_to_auto =  auto_mention_set.difference(gold_mention_set)
+    mapping = match_trimmed_spans(unique_to_auto, unique_to_gold, text)
+    # Apply mapping to create new auto_mention_set
+    remap_mentions(mapping, auto_mention_set, auto_mentions, auto_clusters, auto_cluster_set, cluster_index)
 
     # Create a mapping based on heads
     head_dict = defaultdict(lambda: {'auto': [], 'gold': []})
@@ -100,25 +83,7 @@ def match_boundaries(gold_mention_set, auto_mention_set, auto_mentions, auto_clu
             mapping[amentions[0]] = gmentions[0]
 
     # Apply mapping to create new auto_mention_set
-    for mention in mapping:
-        auto_mention_set.remove(mention)
-        auto_mention_set.add(mapping[mention])
-        cluster_id = auto_mentions.pop(mention)
-        auto_mentions[mapping[mention]] = cluster_id
-        auto_clusters[cluster_id].remove(mention)
-        auto_clusters[cluster_id].append(mapping[mention])
-        to_remove = None
-        for cluster in auto_cluster_set:
-            if mention in cluster:
-                to_remove = cluster
-        auto_cluster_set.remove(to_remove)
-        ncluster = []
-        for mention2 in to_remove:
-            if mention2 == mention:
-                mention2 = mapping[mention]
-            ncluster.append(mention2)
-        ncluster = tuple(ncluster)
-        auto_cluster_set.add(ncluster)
+    remap_mentions(mapping, auto_mention_set, auto_mentions, auto_clusters, auto_cluster_set, cluster_index)
 
 def print_conll_style_part(out, text, mentions, doc, part):
     doc_str = doc
@@ -129,8 +94,7 @@ def print_conll_style_part(out, text, mentions, doc, part):
     starts = defaultdict(lambda: [])
     ends = defaultdict(lambda: [])
     singles = defaultdict(lambda: [])
-    for mention in mentions:
-        cluster_id = mentions[mention]
+    for mention, cluster_id in mentions.items():
         if mention[2] - mention[1] == 1:
             singles[mention[0], mention[1]].append(cluster_id)
         else:
@@ -234,7 +198,7 @@ def print_headless_mentions(out, parses, heads, mentions):
         if end - start > 1:
             node = parses[sentence].get_nodes('lowest', start, end)
             if node is None:
-                print(mention_text(text, mention), file=out)
+                print(parses[sentence].word_yield((start, end)), file=out)
                 print(text_tree(parses[sentence], False), file=out)
 
 def print_mention(out, with_context, gold_parses, gold_heads, text, mention, colour=None, extra=False, return_str=False):
@@ -3,6 +3,9 @@
 # vim: set ts=2 sw=2 noet:
 
 import sys
+from array import array
+
+from .pstree import TreeIterator
 
 #TODO: Handle other langauges
 
@@ -36,32 +39,94 @@ collins_mapping_table = {
   'META': ('right', [])
 }
 
-def add_head(head_map, tree, head):
-    tree_repr = (tree.span, tree.label)
-    head_map[tree_repr] = head
+def compile_collins_table(table):
+    '''Convert each rule of the table to a flag for searching from the right,
+    and a dict from label to priority (the position of its first occurrence
+    in the rule, lower is better).'''
+    compiled = {}
+    for label, (direction, options) in table.items():
+        priorities = {}
+        for priority, option in enumerate(options):
+            if option not in priorities:
+                priorities[option] = priority
+        compiled[label] = (direction == 'right', priorities)
+    return compiled
+
+collins_priority_table = compile_collins_table(collins_mapping_table)
+
+collins_NP_rules = [
+    ('last', set(['NN', 'NNP', 'NNPS', 'NNS', 'NX', 'POS', 'JJR'])),
+    ('first', set(['NP', 'NML'])),
+    ('last', set(['$', 'ADJP', 'PRN'])),
+    ('last', set(['CD'])),
+    ('last', set(['JJ', 'JJS', 'RB', 'QP']))
+]
+
+class HeadMap:
+    '''The heads of the nodes of a tree, each found the first time it (or an
+    ancestor) is requested, so only the heads that are used are found.  Each
+    node's position in a pre-order traversal is stored in index, and heads
+    holds, for each position, the position in words of the (span, word, POS)
+    of the node's head, or -1 if it has not been found yet.'''
+    def __init__(self, tree):
+        self.tree = tree
+        self.index = None
+        self.heads = None
+        self.words = []
+
+    def get(self, tree):
+        if self.index is None:
+            self.index = {}
+            for position, node in enumerate(TreeIterator(self.tree, 'pre')):
+                self.index[node] = position
+            self.heads = array('i', [-1]) * len(self.index)
+        head = self.heads[self.index[tree]]
+        if head < 0:
+            head = self.find(tree)
+        return self.words[head]
+
+    def find(self, tree):
+        '''Find the heads of this node and any of its descendants that are not
+        known yet, handling each node after its subtrees, without recursion.'''
+        index = self.index
+        heads = self.heads
+        words = self.words
+        nodes = []
+        stack = [tree]
+        while len(stack) > 0:
+            node = stack.pop()
+            if heads[index[node]] < 0:
+                nodes.append(node)
+                stack.extend(node.subtrees)
+        for node in reversed(nodes):
+            # A word is it's own head
+            if node.word is not None:
+                heads[index[node]] = len(words)
+                words.append((node.span, node.word, node.label))
+                continue
+
+            sub_heads = [heads[index[subtree]] for subtree in node.subtrees]
+            labels = [subtree.label for subtree in node.subtrees]
+            tags = [words[head][2] for head in sub_heads]
+            heads[index[node]] = sub_heads[collins_choose_head(node.label, labels, tags)]
+        return heads[index[tree]]
 
 def get_head(head_map, tree):
-    tree_repr = (tree.span, tree.label)
-    return head_map[tree_repr]
-
-def first_search(tree, options, head_map):
-    for subtree in tree.subtrees:
-        if get_head(head_map, subtree)[2] in options or subtree.label in options:
-            add_head(head_map, tree, get_head(head_map, subtree))
-            return True
-    return False
-
-def last_search(tree, options, head_map):
-    for i in range(len(tree.subtrees) - 1, -1, -1):
-        subtree = tree.subtrees[i]
-        if get_head(head_map, subtree)[2] in options or subtree.label in options:
-            add_head(head_map, tree, get_head(head_map, subtree))
-            return True
-    return False
-
-def collins_NP(tree, head_map):
-    for subtree in tree.subtrees:
-        collins_find_heads(subtree, head_map)
+    return head_map.get(tree)
+
+def first_search(labels, tags, options):
+    for i in range(len(labels)):
+        if tags[i] in options or labels[i] in options:
+            return i
+    return -1
+
+def last_search(labels, tags, options):
+    for i in range(len(labels) - 1, -1, -1):
+        if tags[i] in options or labels[i] in options:
+            return i
+    return -1
+
+def collins_NP(labels, tags):
     #TODO:todo Extra special cases for NPs
 ### Ignore the row for NPs -- I use a special set of rules for this. For these
 ### I initially remove ADJPs, QPs, and also NPs which dominate a possesive
@@ -71,64 +136,63 @@ def collins_NP(tree, head_map):
 
     #TODO:todo handle NML properly
 
-    if get_head(head_map, tree.subtrees[-1])[2] == 'POS':
-        add_head(head_map, tree, get_head(head_map, tree.subtrees[-1]))
-        return
-    if last_search(tree, set(['NN', 'NNP', 'NNPS', 'NNS', 'NX', 'POS', 'JJR']), head_map):
-        return
-    if first_search(tree, set(['NP', 'NML']), head_map):
-        return
-    if last_search(tree, set(['$', 'ADJP', 'PRN']), head_map):
-        return
-    if last_search(tree, set(['CD']), head_map):
-        return
-    if last_search(tree, set(['JJ', 'JJS', 'RB', 'QP']), head_map):
-        return
-    add_head(head_map, tree, get_head(head_map, tree.subtrees[-1]))
-
-def collins_find_heads(tree, head_map=None):
-    if head_map is None:
-        head_map = {}
-    for subtree in tree.subtrees:
-        collins_find_heads(subtree, head_map)
-
-    # A word is it's own head
-    if tree.word is not None:
-        head = (tree.span, tree.word, tree.label)
-        add_head(head_map, tree, head)
-        return head_map
-
+    if tags[-1] == 'POS':
+        return len(labels) - 1
+    for direction, options in collins_NP_rules:
+        if direction == 'first':
+            choice = first_search(labels, tags, options)
+        else:
+            choice = last_search(labels, tags, options)
+        if choice >= 0:
+            return choice
+    return len(labels) - 1
+
+def collins_choose_head(label, labels, tags):
+    '''Choose which subtree provides the head of a node, given the node's
+    label, and the labels and head POS tags of its subtrees.'''
     # If the label for this node is not in the table we are either at the bottom,
     # at an NP, or have an error
-    if tree.label not in collins_mapping_table:
-        if tree.label in ['NP', 'NML']:
-            collins_NP(tree, head_map)
+    if label not in collins_priority_table:
+        if label in ['NP', 'NML']:
+            return collins_NP(labels, tags)
         else:
             # TODO: Consider alternative error announcement means
-###         if tree.label not in ['ROOT', 'TOP', 'S1', '']:
-###             print("Unknown Label: %s" % tree.label, file=sys.stderr)
-###             print("In tree:", tree.root(), file=sys.stderr)
-            add_head(head_map, tree, get_head(head_map, tree.subtrees[-1]))
-        return head_map
-
-    # Look through and take the first/last occurrence that matches
-    info = collins_mapping_table[tree.label]
-    for label in info[1]:
-        for i in range(len(tree.subtrees)):
-            if info[0] == 'right':
-                i = len(tree.subtrees) - i - 1
-            subtree = tree.subtrees[i]
-            if subtree.label == label or get_head(head_map, subtree)[2] == label:
-                add_head(head_map, tree, get_head(head_map, subtree))
-                return head_map
+###         if label not in ['ROOT', 'TOP', 'S1', '']:
+###             print("Unknown Label: %s" % label, file=sys.stderr)
+            return len(labels) - 1
+
+    # Take the subtree whose label or head tag comes first in the rule, and
+    # the first/last such subtree if there are several
+    from_right, priorities = collins_priority_table[label]
+    if from_right:
+        order = range(len(labels) - 1, -1, -1)
+    else:
+        order = range(len(labels))
+    choice = -1
+    best = len(priorities)
+    for i in order:
+        priority = priorities.get(labels[i], best)
+        tag_priority = priorities.get(tags[i], best)
+        if tag_priority < priority:
+            priority = tag_priority
+        if priority < best:
+            choice = i
+            best = priority
+            if priority == 0:
+                break
+    if choice >= 0:
+        return choice
 
     # Final fallback
-    if info[0] == 'left':
-        add_head(head_map, tree, get_head(head_map, tree.subtrees[0]))
+    if from_right:
+        return len(labels) - 1
     else:
-        add_head(head_map, tree, get_head(head_map, tree.subtrees[-1]))
+        return 0
 
-    return head_map
+def collins_find_heads(tree):
+    '''Get a HeadMap for the tree.  Heads are found when they are first
+    requested with get_head.'''
+    return HeadMap(tree)
 
 '''Text from Collins' website:
 
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import sys
 from collections import defaultdict
 
 DEFAULT_LABEL = 'label_not_set'
@@ -23,38 +24,56 @@ class TreeIterator:
     (. .)
     (S (NP-SBJ (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti))) (. .))
     (ROOT (S (NP-SBJ (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti))) (. .)))
+
+    Terminals alone can be visited with 'leaves', and any order can be limited
+    to nodes with the given labels:
+    >>> [node.word for node in TreeIterator(tree, 'leaves')]
+    ['Ms.', 'Haag', 'plays', 'Elianti', '.']
+    >>> [node.span for node in TreeIterator(tree, 'pre', ['NP', 'NP-SBJ'])]
+    [(0, 2), (3, 4)]
+
+    The traversal keeps its own stack, so it works on trees of any depth.
     '''
-    def __init__(self, tree, order='pre'):
+    def __init__(self, tree, order='pre', labels=None):
+        if order not in ['pre', 'post', 'leaves']:
+            raise Exception("%s is not a valid order" % str(order))
         self.tree = tree
-        self.pos = [0]
         self.order = order
+        self.labels = labels
+        self.nodes = self.traverse()
 
     def __iter__(self):
         return self
 
-    def next(self):
+    def __next__(self):
+        return next(self.nodes)
+
+    def traverse(self):
+        pre = self.order == 'pre'
+        post = self.order == 'post'
+        labels = self.labels
+        # The path from the starting node to the current one, and for each node
+        # on it the position of the next subtree to visit
+        path = [self.tree]
+        positions = [0]
         while True:
-            if len(self.pos) == 0:
-                raise StopIteration
-
-            # For pre-order traversal, return nodes when first reached
-            ans = None
-            if self.order == 'pre' and self.pos[-1] == 0:
-                ans = self.tree
-
-            # Update internal state to point at the next node in the tree
-            if self.pos[-1] < len(self.tree.subtrees):
-                self.tree = self.tree.subtrees[self.pos[-1]]
-                self.pos[-1] += 1
-                self.pos.append(0)
+            tree = path[-1]
+            pos = positions[-1]
+            if pos == 0 and pre:
+                if labels is None or tree.label in labels:
+                    yield tree
+            if pos < len(tree.subtrees):
+                positions[-1] = pos + 1
+                path.append(tree.subtrees[pos])
+                positions.append(0)
             else:
-                if self.order == 'post':
-                    ans = self.tree
-                self.tree = self.tree.parent
-                self.pos.pop()
-
-            if ans is not None:
-                return ans
+                if post or (pos == 0 and not pre):
+                    if labels is None or tree.label in labels:
+                        yield tree
+                path.pop()
+                positions.pop()
+                if len(path) == 0:
+                    return
 
 class PSTree:
     '''Phrase Structure Tree
@@ -78,11 +97,17 @@ class PSTree:
     >>> tree.word_yield()
     'was named *-1 a nonexecutive director of this British industrial conglomerate'
     '''
+    # Trees for every sentence of a corpus can be held at once, so nodes have no
+    # per-instance __dict__, and labels are interned so each is stored once.
+    __slots__ = ('word', 'label', 'span', 'parent', 'subtrees', 'span_index', 'leaf_cache')
+
     def __init__(self, word=None, label=DEFAULT_LABEL, span=(0, 0), parent=None, subtrees=None):
         self.word = word
-        self.label = label
+        self.label = sys.intern(label)
         self.span = span
         self.parent = parent
+        self.span_index = None
+        self.leaf_cache = None
         self.subtrees = []
         if subtrees is not None:
             self.subtrees = subtrees
@@ -110,10 +135,10 @@ class PSTree:
 
     def root(self):
         '''Follow parents until a node is reached that has no parent.'''
-        if self.parent is not None:
-            return self.parent.root()
-        else:
-            return self
+        tree = self
+        while tree.parent is not None:
+            tree = tree.parent
+        return tree
 
     def __repr__(self):
         '''Return a bracket notation style representation of the tree.'''
@@ -131,6 +156,8 @@ class PSTree:
 
     def calculate_spans(self, left=0):
         '''Update the spans for every node in this tree.'''
+        self.span_index = None
+        self.leaf_cache = None
         right = left
         if self.is_terminal():
             right += 1
@@ -170,6 +197,41 @@ class PSTree:
                 sub.production_list(ans)
         return ans
 
+    def build_leaf_cache(self):
+        '''Store the words and POS tags of the terminals of this tree, in order.
+        The cache is kept on the root, and is cleared by calculate_spans and
+        clear_caches.  If the terminal spans are not consecutive it is marked
+        as unusable, and leaves() walks the tree instead.'''
+        words = []
+        tags = []
+        left = self.span[0]
+        for node in TreeIterator(self, 'leaves'):
+            if node.span != (left + len(words), left + len(words) + 1):
+                self.leaf_cache = False
+                return
+            words.append(node.word)
+            tags.append(node.label)
+        self.leaf_cache = (words, tags)
+
+    def leaves(self, span=None):
+        '''Return the words and POS tags of the terminals in this subtree (and
+        within the span, if given) as two lists.'''
+        first, last = self.span
+        if span is not None:
+            first = max(first, span[0])
+            last = min(last, span[1])
+        root = self.root()
+        if root.leaf_cache is None:
+            root.build_leaf_cache()
+        if root.leaf_cache is False:
+            nodes = [node for node in TreeIterator(self, 'leaves') if first <= node.span[0] < last]
+            return [node.word for node in nodes], [node.label for node in nodes]
+        words, tags = root.leaf_cache
+        offset = root.span[0]
+        first = max(first - offset, 0)
+        last = max(last - offset, 0)
+        return words[first:last], tags[first:last]
+
     def word_yield(self, span=None, as_list=False):
         '''Return the set of words at terminal nodes, either as a space separated
         string, or as a list.'''
@@ -184,14 +246,7 @@ class PSTree:
             else:
                 return None
         else:
-            ans = []
-            for subtree in self.subtrees:
-                words = subtree.word_yield(span, as_list)
-                if words is not None:
-                    if as_list:
-                        ans += words
-                    else:
-                        ans.append(words)
+            ans = [word for word in self.leaves(span)[0] if word is not None]
             if not as_list:
                 ans = ' '.join(ans)
             return ans
@@ -215,6 +270,20 @@ class PSTree:
         if request == 'lowest' and start < 0 and end < 0:
             raise Exception("Lowest is not well defined when both ends are wildcards")
 
+        # Exact spans on a root are looked up in the span index
+        if self.parent is None and node_list is None and start >= 0 and end >= 0:
+            if self.span_index is None:
+                self.build_span_index()
+            nodes = self.span_index.get((start, end))
+            if request == 'all':
+                return [] if nodes is None else nodes[:]
+            elif nodes is None:
+                return None
+            elif request == 'highest':
+                return nodes[0]
+            else:
+                return nodes[-1]
+
         if request == 'all' and node_list is None:
             node_list = []
         if request == 'highest':
@@ -242,6 +311,29 @@ class PSTree:
         else:
             return None
 
+    def build_span_index(self):
+        '''Map each span in this tree to the nodes with it, highest first.  The
+        index is kept on the root, and is cleared by calculate_spans and
+        clear_caches.'''
+        index = {}
+        stack = [self]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.span in index:
+                index[node.span].append(node)
+            else:
+                index[node.span] = [node]
+            stack.extend(reversed(node.subtrees))
+        self.span_index = index
+
+    def clear_caches(self):
+        '''Clear the span index and leaf cache of this tree's root, which must
+        be done after nodes are added, removed or moved, or words and POS tags
+        are changed.'''
+        root = self.root()
+        root.span_index = None
+        root.leaf_cache = None
+
     def get_spanning_nodes(self, start, end, node_list=None):
         return_ans = False
         if node_list is None:
@@ -289,7 +381,7 @@ def tree_from_text(text, allow_empty_labels=False, allow_empty_words=False):
             if cur.label is DEFAULT_LABEL:
                 if len(word) == 0 and not allow_empty_labels:
                     raise Exception("Empty label found\n%s" % text)
-                cur.label = word
+                cur.label = sys.intern(word)
                 word = ''
             if word != '':
                 raise Exception("Stray '%s' while processing\n%s" % (word, text))
@@ -313,7 +405,7 @@ def tree_from_text(text, allow_empty_labels=False, allow_empty_words=False):
             if cur.label is DEFAULT_LABEL:
                 if len(word) == 0 and not allow_empty_labels:
                     raise Exception("Empty label found\n%s" % text)
-                cur.label = word
+                cur.label = sys.intern(word)
                 word = ''
             else:
                 word += char
@@ -4,6 +4,7 @@
 '''Various string representations of trees.'''
 
 from .parse_errors import get_errors
+from .pstree import TRACE_LABEL
 
 # TODO:todo Fix handling of traces throughout
 # Handling of unary order
@@ -13,22 +14,22 @@ from .parse_errors import get_errors
 
 def text_words(tree, show_traces=False):
     '''Print just the words in the tree.'''
+    words, tags = tree.leaves()
     text = []
-    for node in tree:
-        if node.is_terminal():
-            if node.is_trace() and not show_traces:
-                continue
-            text.append(node.word)
+    for word, tag in zip(words, tags):
+        if tag == TRACE_LABEL and not show_traces:
+            continue
+        text.append(word)
     return ' '.join(text)
 
 def text_POS_tagged(tree, show_traces=False):
     '''Print words and part of speech tags in the tree.'''
+    words, tags = tree.leaves()
     text = []
-    for node in tree:
-        if node.is_terminal():
-            if node.is_trace() and not show_traces:
-                continue
-            text.append(tree.word + '|' + tree.label)
+    for word, tag in zip(words, tags):
+        if tag == TRACE_LABEL and not show_traces:
+            continue
+        text.append(word + '|' + tag)
     return ' '.join(text)
 
 def text_tree(tree, single_line=True, show_traces=False, depth=0):
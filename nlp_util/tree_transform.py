@@ -8,6 +8,7 @@ def change_label_by_node(node, new_label, in_place):
     if not in_place:
         node = clone_and_find(node)
     node.label = new_label
+    node.clear_caches()
     return (True, (node.root(), node))
 
 def change_label_by_span(tree, new_label, span, cur_label, in_place=True):
@@ -63,6 +64,7 @@ def add_node(tree, span, label, position=0, in_place=True):
         node.parent.subtrees.remove(node)
         nnode.subtrees.append(node)
         node.parent = nnode
+    tree.clear_caches()
 
     return (True, (tree, nnode))
 
@@ -78,6 +80,7 @@ def remove_node_by_node(node, in_place):
         subtree.parent = parent
         parent.subtrees.insert(position, subtree)
         position += 1
+    parent.clear_caches()
     return (True, (parent, node, init_position, position))
 
 def remove_node_by_span(tree, span, label, position, in_place):
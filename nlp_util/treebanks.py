@@ -2,6 +2,9 @@
 # -*- coding: utf-8 -*-
 # vim: set ts=2 sw=2 noet:
 
+import re
+import weakref
+
 from .pstree import *
 
 # TODO: Handle malformed input with trees that have random stuff instead of symbols
@@ -59,6 +62,7 @@ def ptb_cleaning(tree, in_place=True):
             node.label = word_to_POS_mapping[node.word]
         if node.word in bugfix_word_to_POS:
             node.label = bugfix_word_to_POS[node.word]
+    tree.clear_caches()
     return tree
 
 def remove_trivial_unaries(tree, in_place=True):
@@ -78,6 +82,7 @@ def remove_trivial_unaries(tree, in_place=True):
             tree.subtrees = tree.subtrees[0].subtrees
             for subtree in tree.subtrees:
                 subtree.parent = tree
+            tree.clear_caches()
             remove_trivial_unaries(tree, True)
         else:
             for subtree in tree.subtrees:
@@ -110,6 +115,7 @@ def remove_nodes(tree, filter_func, in_place=True, preserve_subtrees=False, init
         tree.subtrees = subtrees
         for subtree in subtrees:
             subtree.parent = tree
+        tree.clear_caches()
     else:
         tree = PSTree(tree.word, tree.label, tree.span, None, subtrees)
     return tree
@@ -143,12 +149,21 @@ def remove_function_tags(tree, in_place=True):
     >>> tree = tree_from_text("(ROOT (S (NP-SBJ (`` ``) (NP-TTL (NNP Funny) (NNP Business)) ('' '') (PRN (-LRB- -LRB-) (NP (NNP Soho)) (, ,) (NP (CD 228) (NNS pages)) (, ,) (NP ($ $) (CD 17.95)) (-RRB- -RRB-)) (PP (IN by) (NP (NNP Gary) (NNP Katzenstein)))) (VP (VBZ is) (NP-PRD (NP (NN anything)) (PP (RB but)))) (. .)))")
     >>> remove_function_tags(tree)
     (ROOT (S (NP (`` ``) (NP (NNP Funny) (NNP Business)) ('' '') (PRN (-LRB- -LRB-) (NP (NNP Soho)) (, ,) (NP (CD 228) (NNS pages)) (, ,) (NP ($ $) (CD 17.95)) (-RRB- -RRB-)) (PP (IN by) (NP (NNP Gary) (NNP Katzenstein)))) (VP (VBZ is) (NP (NP (NN anything)) (PP (RB but)))) (. .)))
+
+    # POS tags are updated too
+    >>> tree = tree_from_text("(ROOT (S (NP-SBJ (NNP-X Ms.) (NNP Haag)) (VP (VBZ plays)) (. .)))")
+    >>> tree.leaves()[1]
+    ['NNP-X', 'NNP', 'VBZ', '.']
+    >>> remove_function_tags(tree).leaves()[1]
+    ['NNP', 'NNP', 'VBZ', '.']
     '''
     label = split_label_type_and_function(tree.label)[0]
     if in_place:
         for subtree in tree.subtrees:
             remove_function_tags(subtree, True)
-        tree.label = label
+        if label != tree.label:
+            tree.label = label
+            tree.clear_caches()
     else:
         subtrees = [remove_function_tags(subtree, False) for subtree in tree.subtrees]
         tree = PSTree(tree.word, label, tree.span, None, subtrees)
@@ -234,11 +249,17 @@ def homogenise_tree(tree, tag_set=ptb_tag_set):
             tree = root
     return tree
 
+# Text read past the end of a tree by ptb_read_tree, kept for the next call on
+# the same source.
+ptb_pending_text = weakref.WeakKeyDictionary()
+ptb_bracket_regex = re.compile('[()]')
+
 def ptb_read_tree(source, return_empty=False, allow_empty_labels=False, allow_empty_words=False, blank_line_coverage=False):
     '''Read a single tree from the given PTB file.
 
-    The function reads a character at a time, stopping as soon as a tree can be
-    constructed, so multiple trees on a sinlge line are manageable.
+    The file is read a line at a time, stopping as soon as a tree can be
+    constructed.  The rest of the line is kept for the next call with the same
+    source, so multiple trees on a sinlge line are manageable.
 
     >>> from io import StringIO
     >>> file_text = """(ROOT (S
@@ -251,32 +272,76 @@ def ptb_read_tree(source, return_empty=False, allow_empty_labels=False, allow_em
     ...   (. .) ))"""
     >>> in_file = StringIO(file_text)
     >>> ptb_read_tree(in_file)
-    (ROOT (S (NP-SBJ (NNP Scotty)) (VP (VBD did) (RB not) (VP (VB go) (ADVP (RB back)) (PP (TO to) (NP (NN school))))) (. .)))'''
-    cur_text = ''
-    depth = 0
+    (ROOT (S (NP-SBJ (NNP Scotty)) (VP (VBD did) (RB not) (VP (VB go) (ADVP (RB back)) (PP (TO to) (NP (NN school))))) (. .)))
+    >>> in_file = StringIO("(ROOT (NP (NN one))) (()) (ROOT (NP (NN two)))")
+    >>> ptb_read_tree(in_file)
+    (ROOT (NP (NN one)))
+    >>> ptb_read_tree(in_file, True)
+    'Empty'
+    >>> ptb_read_tree(in_file)
+    (ROOT (NP (NN two)))
+    >>> print(ptb_read_tree(in_file))
+    None'''
+    text, start = ptb_pending_text.pop(source, ('', 0))
     while True:
-        char = source.read(1)
-        if char == '':
-            return None
-            break
-        if char == '\n' and cur_text == ' ' and blank_line_coverage:
-            return "Empty"
-        if char in '\n\t':
-            char = ' '
-        cur_text += char
-        if char == '(':
-            depth += 1
-        elif char == ')':
-            depth -= 1
-        if depth == 0:
-            if '()' in cur_text:
-                if return_empty:
-                    return "Empty"
-                cur_text = ''
-                continue
-            if '(' in cur_text:
-                break
+        # A blank line straight after the previous tree marks an empty parse
+        if blank_line_coverage:
+            while len(text) - start < 2:
+                line = source.readline()
+                if line == '':
+                    break
+                text = text[start:] + line
+                start = 0
+            if len(text) - start > 1 and text[start] in ' \n\t' and text[start + 1] == '\n':
+                ptb_pending_text[source] = (text, start + 2)
+                return "Empty"
+
+        # Find the bracket that closes the tree, reading more lines as needed
+        lines = []
+        depth = 0
+        seen_open = False
+        seen_empty = False
+        end = None
+        while end is None:
+            # Skip over whole lines that cannot close the tree, just counting
+            # brackets.  The rest of a line after a tree is always scanned, as
+            # counting it each time would be quadratic for many trees on a line.
+            if start == 0 and depth > text.count(')'):
+                opens = text.count('(')
+                depth += opens - text.count(')')
+                seen_open = seen_open or opens > 0
+                seen_empty = seen_empty or '()' in text
+            else:
+                for match in ptb_bracket_regex.finditer(text, start):
+                    bracket = match.start()
+                    if text[bracket] == '(':
+                        depth += 1
+                        seen_open = True
+                    else:
+                        depth -= 1
+                        if bracket > start and text[bracket - 1] == '(':
+                            seen_empty = True
+                    if depth == 0 and (seen_empty or seen_open):
+                        end = bracket + 1
+                        break
+            if end is None:
+                lines.append(text[start:])
+                text = source.readline()
+                start = 0
+                if text == '':
+                    return None
+        lines.append(text[start:end])
+        start = end
+
+        if seen_empty:
+            if return_empty:
+                ptb_pending_text[source] = (text, start)
+                return "Empty"
+            continue
+        break
 
+    ptb_pending_text[source] = (text, start)
+    cur_text = ''.join(lines).replace('\n', ' ').replace('\t', ' ')
     tree = tree_from_text(cur_text, allow_empty_labels, allow_empty_words)
     ptb_cleaning(tree)
     return tree
@@ -318,18 +383,76 @@ def conll_read_tree(source, return_empty=False, allow_empty_labels=False, allow_
         if line == '':
             break
         cur_text.append(line)
+    return conll_tree_from_lines(cur_text)
 
-    text = ''
-    for line in cur_text:
+def conll_tree_from_lines(lines):
+    '''Build the tree for a single sentence from its CoNLL lines.'''
+    words, tags, parse_bits = [], [], []
+    for line in lines:
         if len(line) == 0 or line[0] == '#':
             continue
         line = line.split()
-        word = line[3]
-        pos = line[4]
-        tree = line[5]
+        words.append(line[3])
+        tags.append(line[4])
+        parse_bits.append(line[5])
+    return conll_tree_from_columns(words, tags, parse_bits)
+
+def conll_tree_from_columns(words, tags, parse_bits):
+    '''Build the tree for a single sentence from its word, POS and parse bit
+    columns.  Nodes and spans are created while walking the parse bits, e.g.
+    '(NP(NP*' opens two nodes above the word and '*))' closes two after it.
+
+    >>> words = ['The', 'U.S.', 'said', '.']
+    >>> tags = ['DT', 'NNP', 'VBD', '.']
+    >>> parse_bits = ['(TOP(S(NP*', '*)', '(VP*)', '*))']
+    >>> tree = conll_tree_from_columns(words, tags, parse_bits)
+    >>> print(tree)
+    (TOP (S (NP (DT The) (NNP U.S.)) (VP (VBD said)) (. .)))
+    >>> tree.subtrees[0].subtrees[1].span
+    (2, 3)'''
+    root = None
+    cur = None
+    for pos in range(len(words)):
+        bits = parse_bits[pos].split('*')
+        opening, closing = bits[0], bits[1]
+        if opening != '':
+            labels = opening.split('(')
+            if labels[0] != '':
+                raise Exception("Stray '%s' while processing\n%s" % (labels[0], conll_columns_text(words, tags, parse_bits)))
+            for label in labels[1:]:
+                if label == '':
+                    raise Exception("Empty label found\n%s" % conll_columns_text(words, tags, parse_bits))
+                node = PSTree(None, label, (pos, pos), cur)
+                if cur is None:
+                    root = node
+                else:
+                    cur.subtrees.append(node)
+                cur = node
+        leaf = PSTree(words[pos], tags[pos], (pos, pos + 1), cur)
+        if cur is None:
+            root = leaf
+        else:
+            cur.subtrees.append(leaf)
+        if closing != '':
+            if closing.strip(')') != '':
+                raise Exception("Stray '%s' while processing\n%s" % (closing, conll_columns_text(words, tags, parse_bits)))
+            for i in range(len(closing)):
+                if cur is None:
+                    break
+                cur.span = (cur.subtrees[0].span[0], pos + 1)
+                cur = cur.parent
+    if cur is not None:
+        raise Exception("Text did not include complete tree\n%s" % conll_columns_text(words, tags, parse_bits))
+    return root
+
+def conll_columns_text(words, tags, parse_bits):
+    '''The bracketed text of a sentence given as CoNLL columns, for error
+    messages.'''
+    text = ''
+    for word, pos, tree in zip(words, tags, parse_bits):
         tree = tree.split('*')
         text += '%s(%s %s)%s' % (tree[0], pos, word, tree[1])
-    return tree_from_text(text)
+    return text
 
 def generate_trees(source, tree_reader=ptb_read_tree, max_sents=-1, return_empty=False, allow_empty_labels=False, allow_empty_words=False):
     '''Read trees from the given file (opening the file if only a string is given).
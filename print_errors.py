@@ -7,10 +7,12 @@ import sys
 from nlp_util import coreference_reading, coreference_rendering, coreference, init
 
 if __name__ == '__main__':
-    init.argcheck(sys.argv, 4, 5, "Print coreference resolution errors", "<prefix> <gold_dir> <test> [resolve span errors first? T | F]")
+    init.argcheck(sys.argv, 4, 6, "Print coreference resolution errors", "<prefix> <gold_dir> <test> [resolve span errors first? T | F] [gold cache dir]")
+    cache_dir = None
+    if len(sys.argv) == 6:
+        cache_dir = sys.argv[5]
 
-    auto = coreference_reading.read_conll_coref_system_output(sys.argv[3])
-    gold = coreference_reading.read_conll_matching_files(auto, sys.argv[2])
+    gold_index = coreference_reading.read_conll_index(sys.argv[2])
 
     out_cluster_errors = open(sys.argv[1] + '.cluster_errors', 'w')
     out_cluster_context = open(sys.argv[1] + '.cluster_context', 'w')
@@ -38,27 +40,26 @@ if __name__ == '__main__':
         instructions = ['# ' + inst for inst in instructions]
         print('\n'.join(instructions), file=outfile)
 
-    # Define an order
-    order = []
-    for doc in auto:
-        for part in auto[doc]:
-            order.append((doc, part))
-    order.sort()
-
-    for doc, part in order:
+    # Read the system output and gold data one document at a time, in sorted order
+    parts = coreference_reading.generate_conll_system_and_gold_docs(sys.argv[3], sys.argv[2], gold_index, cache_dir)
+    for doc, part, auto_doc, gold_doc in parts:
         # Setup
         for out in out_files:
             print("\n# %s %s\n" % (doc, part), file=out)
 
-        text = gold[doc][part]['text']
+        if gold_doc is None:
+            print(doc, part, "not in gold", file=sys.stderr)
+            continue
+
+        text = gold_doc['text']
 
-        gold_parses = gold[doc][part]['parses']
-        gold_heads = gold[doc][part]['heads']
-        gold_mentions = gold[doc][part]['mentions']
-        gold_clusters = gold[doc][part]['clusters']
+        gold_parses = gold_doc['parses']
+        gold_heads = gold_doc['heads']
+        gold_mentions = gold_doc['mentions']
+        gold_clusters = gold_doc['clusters']
 
-        auto_mentions = auto[doc][part]['mentions']
-        auto_clusters = auto[doc][part]['clusters']
+        auto_mentions = auto_doc['mentions']
+        auto_clusters = auto_doc['clusters']
 
         gold_cluster_set = coreference.set_of_clusters(gold_clusters)
         auto_cluster_set = coreference.set_of_clusters(auto_clusters)